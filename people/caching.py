@@ -0,0 +1,92 @@
+"""
+Per-user cache of list and retrieve responses, with conditional GET.
+
+Every user has a version per resource (queries, responses, ...), the time it
+last changed. Cached bodies and ETags are keyed by it, so bumping a version
+when one of the user's objects changes invalidates all of them at once and a
+client refresh can be answered from the cache alone.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from rest_framework import response
+
+from . import routers
+
+import hashlib
+import time
+
+
+def version_key(resource, user_id):
+    return 'version:{}:{}'.format(resource, user_id)
+
+
+def version(resource, user_id):
+    """
+    Returns when user_id's resource last changed, or now if that isn't known
+    (e.g. the entry was evicted), which invalidates anything cached before.
+    """
+    key = version_key(resource, user_id)
+    value = cache.get(key)
+    if value == None:
+        cache.add(key, time.time(), None)
+        value = cache.get(key)
+    return value
+
+
+def invalidate(resource, user_id):
+    """
+    Bumps user_id's version of resource once the current transaction commits,
+    so nothing read before the commit is cached under the new version. The
+    user's reads also stay on the primary until the replicas have the change,
+    so a lagging replica can't be cached under the new version either.
+    """
+    def bump():
+        cache.set(version_key(resource, user_id), time.time(), None)
+        routers.wrote(user_id)
+    transaction.on_commit(bump)
+
+
+class CachedReadMixin:
+    """
+    Serves list and retrieve from the per-user cache, answering conditional
+    requests with 304 Not Modified. cache_resource names the version the
+    viewset's responses depend on. Without a SHARED_CACHE every request is
+    served by the view itself.
+    """
+    cache_resource = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs))
+
+    def cached(self, request, view):
+        if not settings.SHARED_CACHE:
+            return view()
+
+        modified = version(self.cache_resource, request.user.id)
+        key = hashlib.md5('{}:{}:{}:{}'.format(
+            request.user.id, modified, request.accepted_renderer.format, request.build_absolute_uri(),
+        ).encode()).hexdigest()
+        etag = '"{}"'.format(key)
+
+        resp = get_conditional_response(request, etag=etag, last_modified=int(modified))
+        if resp == None:
+            data = cache.get('response:' + key)
+            if data == None:
+                resp = view()
+                if resp.status_code != 200:
+                    return resp
+                cache.set('response:' + key, resp.data, settings.RESPONSE_CACHE_SECONDS)
+            else:
+                resp = response.Response(data)
+
+        resp['ETag'] = etag
+        resp['Last-Modified'] = http_date(modified)
+        resp['Cache-Control'] = 'private, no-cache'
+        return resp
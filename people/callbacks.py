@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+
+from .models import Callback
+from . import claims, metrics
+
+import aiohttp
+import asyncio
+import json
+import requests
+import threading
+
+
+sessions = threading.local()
+
+
+def session():
+    """
+    Returns this thread's keep-alive session, so repeated callbacks to the
+    same requester reuse connections.
+    """
+    if not hasattr(sessions, 'session'):
+        sessions.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=settings.CALLBACK_CONCURRENCY, pool_maxsize=settings.CALLBACK_CONCURRENCY)
+        sessions.session.mount('http://', adapter)
+        sessions.session.mount('https://', adapter)
+    return sessions.session
+
+
+def claim_due(limit, concurrency):
+    """
+    Claims up to limit callbacks that are due, hiding them from other workers
+    while they're delivered concurrency at a time.
+    """
+    due = Callback.objects.filter(status=Callback.PENDING, nextAttempt__lte=timezone.now()).order_by('nextAttempt')
+    return list(claims.claim(due, limit, claims.lease(limit, concurrency, settings.CALLBACK_TIMEOUT)))
+
+
+def deliver(callback):
+    """
+    POSTs a callback once, then marks it delivered, schedules a retry with
+    exponential backoff, or gives up on it after CALLBACK_MAX_ATTEMPTS.
+    """
+    try:
+        with metrics.timed('callback', 'post'):
+            resp = session().post(callback.url, data=json.loads(callback.payload), timeout=settings.CALLBACK_TIMEOUT)
+            resp.raise_for_status()
+        error = None
+    except requests.RequestException as e:
+        error = str(e)
+
+    return record(callback, error)
+
+
+def record(callback, error):
+    """
+    Records the outcome of a delivery attempt, error being None on success.
+    """
+    try:
+        callback.attempts += 1
+        callback.lastError = error
+
+        if error == None:
+            callback.status = Callback.DELIVERED
+        elif callback.attempts >= settings.CALLBACK_MAX_ATTEMPTS:
+            callback.status = Callback.DEAD
+        else:
+            callback.nextAttempt = timezone.now() + claims.backoff(
+                callback.attempts, settings.CALLBACK_BACKOFF_SECONDS, settings.CALLBACK_MAX_BACKOFF_SECONDS,
+            )
+
+        callback.save(update_fields=('attempts', 'lastError', 'status', 'nextAttempt'))
+    finally:
+        connection.close_if_unusable_or_obsolete()
+
+    return callback
+
+
+async def post(client, callback):
+    """
+    POSTs a callback once with the aiohttp client and returns the error, or
+    None on success.
+    """
+    try:
+        with metrics.timed('callback', 'post'):
+            async with client.post(callback.url, data=json.loads(callback.payload)) as resp:
+                resp.raise_for_status()
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return str(e) or type(e).__name__
+
+
+async def deliver_concurrently(concurrency, poll, once=False, delivered=None):
+    """
+    Keeps up to concurrency callbacks in flight on one pooled aiohttp client,
+    claiming more as soon as any finish, so a single process can wait on
+    hundreds of slow requesters at once. Run it with async_to_sync, so that
+    its database work runs one call at a time on the calling thread and only
+    the POSTs overlap. With once, delivers one batch of due callbacks and
+    returns. Each callback is passed to delivered() once its outcome is
+    recorded.
+    """
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=settings.CALLBACK_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as client:
+        in_flight = {}
+        claiming = True
+        while True:
+            if claiming and len(in_flight) < concurrency:
+                for callback in await sync_to_async(claim_due)(concurrency - len(in_flight), concurrency):
+                    in_flight[asyncio.ensure_future(post(client, callback))] = callback
+                claiming = not once
+
+            if not in_flight:
+                if once:
+                    return
+                await asyncio.sleep(poll)
+                continue
+
+            done, _ = await asyncio.wait(list(in_flight), timeout=poll, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                callback = await sync_to_async(record)(in_flight.pop(task), task.result())
+                if delivered != None:
+                    delivered(callback)
+
+
+def deliver_due(executor, limit, concurrency):
+    """
+    Delivers a batch of up to limit due callbacks on the executor's
+    concurrency threads and returns the delivered callbacks.
+    """
+    return list(executor.map(deliver, claim_due(limit, concurrency)))
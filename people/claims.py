@@ -0,0 +1,41 @@
+"""
+Claiming batches of due rows (callbacks, payments) for a worker. A claimed
+row's nextAttempt is pushed past its lease, which hides it from other
+workers until it is finished or the lease runs out, e.g. if the worker
+died, and retries are scheduled by pushing it out again.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from datetime import timedelta
+import math
+
+
+def claim(due, limit, lease):
+    """
+    Claims up to limit rows of the due queryset for lease in one UPDATE of
+    the rows it locks, skipping rows other workers have locked rather than
+    waiting for them, and returns a queryset of the claimed rows.
+    """
+    until = timezone.now() + lease
+    model = due.model
+    with transaction.atomic():
+        model.objects.filter(pk__in=due.select_for_update(skip_locked=True).values('pk')[:limit]).update(nextAttempt=until)
+    return model.objects.filter(nextAttempt=until)
+
+
+def lease(limit, concurrency, timeout):
+    """
+    How long a batch of limit rows takes at worst when concurrency of them
+    are worked on at once and each takes up to timeout seconds, plus one
+    more round to spare.
+    """
+    return timedelta(seconds=timeout * (math.ceil(limit / concurrency) + 1))
+
+
+def backoff(attempts, seconds, max_seconds):
+    """
+    How long to wait before retrying after attempts failures: seconds,
+    doubling with each further failure up to max_seconds.
+    """
+    return timedelta(seconds=min(seconds * 2 ** (attempts - 1), max_seconds))
@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Attribute, Query, Reputation, Requirement
+from . import caching
+
+from datetime import timedelta
+from functools import reduce
+import operator
+import random
+
+
+# Minimum number of candidates fetched per attempt; claiming a random subset
+# of them keeps concurrent workers from all racing for the same rows.
+WINDOW = 16
+
+# Number of times to refetch candidates after losing races for a window.
+ATTEMPTS = 3
+
+
+def lease(user_id, by_bid=False):
+    """
+    Leases an unanswered query the user may answer for QUERY_LEASE_SECONDS
+    and returns it, or returns None if every such query is currently leased.
+    """
+    queries = lease_many(user_id, 1, by_bid)
+    return queries[0] if queries else None
+
+
+def eligible(user_id):
+    """
+    Returns a filter for the queries the user may answer: those whose
+    minimum reputation the user's score meets and whose requirements the
+    user's attributes all meet. A query meets the latter when it's
+    untargeted or as many of its requirements match the user's attributes as
+    it has requirements.
+    """
+    score = Reputation.objects.get(user_id=user_id).score()
+    reputable = Q(minReputation=None) | Q(minReputation__lte=score)
+
+    attributes = [Q(key=key, value=value) for key, value in Attribute.objects.filter(user_id=user_id).values_list('key', 'value').distinct()]
+    if not attributes:
+        return reputable & Q(numRequirements=0)
+
+    matched = (Requirement.objects.filter(reduce(operator.or_, attributes))
+        .values('query', 'query__numRequirements')
+        .annotate(matches=Count('id'))
+        .filter(matches=F('query__numRequirements'))
+        .values('query'))
+    return reputable & (Q(numRequirements=0) | Q(id__in=matched))
+
+
+def lease_many(user_id, count, by_bid=False):
+    """
+    Leases up to count unanswered queries the user may answer for
+    QUERY_LEASE_SECONDS.
+
+    Queries that have never been retrieved are handed out first, then queries
+    whose lease has expired, oldest lease first. With by_bid, fresh queries
+    are handed out highest bid first.
+    """
+    now = timezone.now()
+    fresh, stale = pending(user_id, now, by_bid)
+
+    leased = []
+    for attempt in range(ATTEMPTS):
+        found = False
+
+        for queryset in (fresh, stale):
+            needed = count - len(leased)
+            if needed == 0:
+                break
+
+            candidates = list(queryset.values_list('id', flat=True)[:max(WINDOW, needed * 2)])
+            found = found or bool(candidates)
+            if not by_bid:
+                random.shuffle(candidates)
+
+            leased += claim(queryset, candidates[:needed], now)
+
+        if not found or len(leased) == count:
+            break
+
+    queries = list(Query.objects.filter(id__in=leased).order_by('-bid' if by_bid else 'created'))
+    # Requesters see lastRetrieved and numRetrievals on their queries
+    for user_id in set(query.user_id for query in queries):
+        caching.invalidate('queries', user_id)
+    return queries
+
+
+def pending(user_id, now, by_bid=False):
+    """
+    Returns the querysets lease_many hands out queries from at time now: the
+    fresh queries the user may answer, then those whose lease has expired.
+    """
+    expired = now - timedelta(seconds=settings.QUERY_LEASE_SECONDS)
+    matches = eligible(user_id)
+
+    # Queries past their expiry that the sweeper hasn't got to yet are skipped
+    live = Q(expires=None) | Q(expires__gt=now)
+
+    fresh = Query.objects.filter(matches, live, pending=True, lastRetrieved=None)
+    fresh = fresh.order_by('-bid') if by_bid else fresh
+    stale = Query.objects.filter(matches, live, pending=True, lastRetrieved__lt=expired).order_by('lastRetrieved')
+    return fresh, stale
+
+
+def claim(queryset, ids, now):
+    """
+    Atomically takes the lease on whichever of the given queries still match
+    queryset, i.e. nobody else has leased them since they were read, and
+    returns their ids.
+    """
+    if not ids:
+        return []
+
+    queryset.filter(id__in=ids).update(lastRetrieved=now, numRetrievals=F('numRetrievals') + 1)
+    return list(Query.objects.filter(id__in=ids, lastRetrieved=now).values_list('id', flat=True))
@@ -0,0 +1,51 @@
+"""
+Server-sent event stream of responses to a requester's queries.
+"""
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Response
+from . import notify
+
+import json
+import time
+
+
+def responses_after(user_id, cursor):
+    created, id = cursor
+    return list(Response.objects.filter(query__user_id=user_id, created__gte=created)
+        .exclude(Q(created=created) & Q(id__lte=id))
+        .order_by('created', 'id')
+        .values('id', 'created', 'query', 'text')[:settings.MAX_PAGE_SIZE])
+
+
+def event(response):
+    return 'id: {}\nevent: response\ndata: {}\n\n'.format(response['id'], json.dumps({
+        'id': str(response['id']),
+        'query': str(response['query']),
+        'text': response['text'],
+    }))
+
+
+def stream(user_id, cursor):
+    """
+    Yields an event for every response after cursor, a (created, id) pair,
+    as soon as it's committed. Comments keep the connection open while
+    nothing happens, and the stream ends after SSE_MAX_SECONDS so clients
+    reconnect (with Last-Event-ID) and workers are recycled.
+    """
+    deadline = time.monotonic() + settings.SSE_MAX_SECONDS
+    yield 'retry: 1000\n\n'
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+
+        responses = notify.wait([notify.responses(user_id)], lambda: responses_after(user_id, cursor), min(remaining, settings.SSE_KEEPALIVE_SECONDS))
+        if not responses:
+            yield ': keepalive\n\n'
+
+        for response in responses:
+            yield event(response)
+            cursor = (response['created'], response['id'])
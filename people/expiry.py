@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Hold, Query, Refund, Ledger, Requirement
+from . import caching, metrics, notify
+
+from collections import Counter
+from datetime import timedelta
+
+
+def expire(limit):
+    """
+    Expires up to limit unanswered queries that are past their expiry time,
+    oldest first: takes them out of the dispatch pool and refunds their bids
+    in bulk. Returns the number of queries expired and cents refunded.
+    """
+    with transaction.atomic():
+        # Locked so a response can't close them meanwhile; other sweepers skip them
+        due = Query.objects.select_for_update(skip_locked=True).filter(pending=True, expires__lte=timezone.now()).order_by('expires')
+        ids = list(due.values_list('id', flat=True)[:limit])
+        if not ids:
+            return 0, 0
+
+        Query.objects.filter(id__in=ids, pending=True).update(pending=False, expired=True)
+        Requirement.objects.filter(query_id__in=ids).delete()
+        queries = list(Query.objects.filter(id__in=ids, expired=True).values_list('id', 'user_id', 'bid'))
+        Refund.objects.bulk_create([Refund(user_id=user_id, query_id=id, amount=bid) for id, user_id, bid in queries])
+
+        refunds = Counter()
+        for id, user_id, bid in queries:
+            refunds[user_id] += bid
+        for user_id, amount in refunds.items():
+            Ledger.apply(user_id, amount)
+            caching.invalidate('queries', user_id)
+            notify.publish(notify.responses(user_id))
+
+    refunded = sum(refunds.values())
+    metrics.QUERIES_EXPIRED.inc(len(queries))
+    metrics.REFUNDED_CENTS.inc(refunded)
+    return len(queries), refunded
+
+
+def release_holds(limit):
+    """
+    Returns up to limit holds older than HOLD_TIMEOUT, which no request is
+    still spending, to their users' balances. Returns the number released.
+    """
+    stale = Hold.objects.filter(created__lte=timezone.now() - timedelta(seconds=settings.HOLD_TIMEOUT)).order_by('created')
+    return sum(hold.release() for hold in stale[:limit])
@@ -0,0 +1,83 @@
+"""
+Streaming export of a requester's queries joined to their responses and
+ratings, as NDJSON or CSV. Rows are read with a server-side cursor and
+written out in chunks, so memory stays flat however many rows there are.
+"""
+from rest_framework.utils.encoders import JSONEncoder
+
+import csv
+import itertools
+import json
+
+
+# Output column -> lookup from Query
+COLUMNS = (
+    ('id', 'id'),
+    ('created', 'created'),
+    ('text', 'text'),
+    ('regex', 'regex'),
+    ('bid', 'bid'),
+    ('callback', 'callback'),
+    ('expired', 'expired'),
+    ('response', 'response__id'),
+    ('responseCreated', 'response__created'),
+    ('responseUser', 'response__user'),
+    ('responseText', 'response__text'),
+    ('satisfactory', 'response__rating__satisfactory'),
+)
+
+CHUNK_SIZE = 2000
+
+encoder = JSONEncoder()
+
+
+def rows(queryset):
+    """
+    Yields each query as a tuple of COLUMNS values.
+    """
+    return queryset.order_by('created', 'id').values_list(*[lookup for name, lookup in COLUMNS]).iterator(chunk_size=CHUNK_SIZE)
+
+
+def chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def to_ndjson(queryset):
+    names = [name for name, lookup in COLUMNS]
+    return chunked(json.dumps(dict(zip(names, row)), cls=JSONEncoder) + '\n' for row in rows(queryset))
+
+
+class Line:
+    """
+    File-like object that csv.writer can write a row to, returning the line.
+    """
+    def write(self, value):
+        return value
+
+
+def plain(value):
+    if value == None:
+        return ''
+    elif isinstance(value, (str, int)):
+        return value
+    return encoder.default(value)
+
+
+def to_csv(queryset):
+    writer = csv.writer(Line())
+    header = writer.writerow([name for name, lookup in COLUMNS])
+    return chunked(itertools.chain([header], (writer.writerow([plain(value) for value in row]) for row in rows(queryset))))
+
+
+# ?type= -> (writer, content type)
+TYPES = {
+    'ndjson': (to_ndjson, 'application/x-ndjson'),
+    'csv': (to_csv, 'text/csv'),
+}
@@ -0,0 +1,110 @@
+"""
+Local stand-ins for the external HTTP services the server talks to, for tests
+and load tests.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+import json
+import sys
+import threading
+import uuid
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server on localhost (on a free port unless one is given) that
+    records every request (and its headers, in headers) and answers with
+    handle(method, path, body) -> (status, payload). By default it answers every request with 200 and an
+    empty JSON object.
+    """
+    daemon_threads = True
+
+    def __init__(self, handle=None, port=0):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.handle = handle or (lambda method, path, body: (200, {}))
+        self.requests = []
+        self.headers = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out have hung up before the answer
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_PUT(self):
+        self.respond('PUT')
+
+    def do_DELETE(self):
+        self.respond('DELETE')
+
+    def respond(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length).decode()
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            body = json.loads(raw or 'null')
+        elif self.headers.get('Content-Type', '').startswith('text/'):
+            body = raw
+        else:
+            body = {key: values[-1] for key, values in parse_qs(raw).items()}
+
+        with self.server.lock:
+            self.server.requests.append((method, self.path, body))
+            self.server.headers.append(dict(self.headers))
+
+        status, payload = self.server.handle(method, self.path, body)
+        content = json.dumps(payload).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+def stripe(method, path, body):
+    """
+    Answers the Stripe API calls the server makes: charges and transfers
+    succeed, except charges of Stripe's tok_chargeDeclined test token.
+    """
+    if method == 'POST' and path.startswith('/v1/charges') and body.get('source') == 'tok_chargeDeclined':
+        return 402, {'error': {'type': 'card_error', 'code': 'card_declined', 'message': 'Your card was declined.'}}
+    for prefix, object in (('/v1/charges', 'charge'), ('/v1/transfers', 'transfer')):
+        if method == 'POST' and path.startswith(prefix):
+            return 200, dict(body, id='{}_{}'.format(object[:2], uuid.uuid4().hex), object=object, amount=int(body.get('amount', 0)))
+    return 404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL ({} {})'.format(method, path)}}
+
+
+def graph(method, path, body):
+    """
+    Answers Messenger Send API calls.
+    """
+    if method == 'POST' and path.startswith('/me/messages'):
+        return 200, {'recipient_id': body['recipient']['id'], 'message_id': 'mid.{}'.format(uuid.uuid4().hex)}
+    return 404, {'error': {'message': 'Unknown path {}'.format(path)}}
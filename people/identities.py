@@ -0,0 +1,84 @@
+"""
+Identity map from Messenger sender ids to the linked account, so the
+process_messenger worker doesn't look up the sender's profile for every
+message. Entries expire after MESSENGER_IDENTITY_TTL seconds and Profile
+saves evict them, which keeps the map coherent with changes made elsewhere.
+"""
+from django.conf import settings
+
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+
+Identity = namedtuple('Identity', ('profileId', 'userId', 'username', 'currentQueryId'))
+
+
+class IdentityMap:
+    """
+    Bounded, thread safe LRU map of sender id to Identity, or to None for
+    senders without a linked account.
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.senders = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, sender, load):
+        """
+        Returns sender's identity, calling load() to fetch it on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(sender)
+            if entry != None and entry[0] > time.monotonic():
+                self.entries.move_to_end(sender)
+                return entry[1]
+            generation = self.generation
+
+        identity = load()
+        with self.lock:
+            # Don't cache what was loaded if a profile was evicted meanwhile
+            if generation == self.generation:
+                self.store(sender, identity)
+        return identity
+
+    def put(self, sender, identity):
+        with self.lock:
+            self.store(sender, identity)
+
+    def forget(self, profile_id, sender=None):
+        """
+        Evicts whatever entry points at profile_id, and sender's entry.
+        """
+        with self.lock:
+            self.generation += 1
+            self.discard(self.senders.get(profile_id))
+            self.discard(sender)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.senders.clear()
+
+    def store(self, sender, identity):
+        self.discard(sender)
+        if identity != None:
+            self.discard(self.senders.get(identity.profileId))
+        self.entries[sender] = (time.monotonic() + self.ttl, identity)
+        if identity != None:
+            self.senders[identity.profileId] = sender
+
+        while len(self.entries) > self.size:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, sender):
+        entry = self.entries.pop(sender, None)
+        if entry != None and entry[1] != None:
+            self.senders.pop(entry[1].profileId, None)
+
+
+senders = IdentityMap(settings.MESSENGER_IDENTITY_CACHE_SIZE, settings.MESSENGER_IDENTITY_TTL)
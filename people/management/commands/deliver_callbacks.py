@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from asgiref.sync import async_to_sync
+
+from people import callbacks, metrics
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued response callbacks to requesters, retrying failures with exponential backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.CALLBACK_CONCURRENCY, help='Number of callbacks in flight at once.')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to sleep when nothing is due.')
+        parser.add_argument('--once', action='store_true', help='Deliver one batch of due callbacks and exit.')
+        parser.add_argument(
+            '--async', action='store_true', dest='use_async',
+            help='Make the POSTs from one asyncio event loop instead of a thread each, for high concurrency.',
+        )
+
+    def handle(self, *args, **options):
+        metrics.export('deliver_callbacks')
+        if options['use_async']:
+            # Runs the loop on another thread and the database work back on this one
+            async_to_sync(callbacks.deliver_concurrently)(
+                options['concurrency'], options['poll'], options['once'], self.report,
+            )
+            return
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            while True:
+                delivered = callbacks.deliver_due(executor, options['concurrency'] * 4, options['concurrency'])
+
+                for callback in delivered:
+                    self.report(callback)
+
+                if options['once']:
+                    break
+                if not delivered:
+                    time.sleep(options['poll'])
+
+    def report(self, callback):
+        self.stdout.write('{} {} attempt {}: {}'.format(
+            callback.id, callback.url, callback.attempts, callback.lastError or callback.status,
+        ))
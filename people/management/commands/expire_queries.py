@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from people import expiry, metrics
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Expires unanswered queries past their expiry time in batches, refunding their bids to the requesters, and releases stale balance holds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help='Maximum number of queries expired per transaction.')
+        parser.add_argument('--poll', type=float, default=10.0, help='Seconds to sleep when nothing is due.')
+        parser.add_argument('--once', action='store_true', help='Expire everything that is due and exit.')
+
+    def handle(self, *args, **options):
+        metrics.export('expire_queries')
+        while True:
+            expired, refunded = expiry.expire(options['batch'])
+            released = expiry.release_holds(options['batch'])
+
+            if expired:
+                self.stdout.write('Expired {} queries, refunded {} cents'.format(expired, refunded))
+            if released:
+                self.stdout.write('Released {} stale holds'.format(released))
+            if expired or released:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll'])
@@ -0,0 +1,162 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from people import fakes
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+import json
+import requests
+import time
+import uuid
+
+
+SCENARIOS = ('create', 'dispatch', 'respond', 'profile', 'deposit', 'messenger')
+
+
+class Client:
+    """
+    A logged in API session for one seeded user.
+    """
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.session.get(self.url('/auth/login/'))
+        resp = self.session.post(self.url('/auth/login/'), data={
+            'username': username,
+            'password': password,
+            'csrfmiddlewaretoken': self.session.cookies.get('csrftoken'),
+        }, headers={'Referer': self.url('/auth/login/')}, allow_redirects=False)
+        if 'sessionid' not in self.session.cookies:
+            raise CommandError('Could not log in as {} (HTTP {}). Was the database seeded with seed_data?'.format(username, resp.status_code))
+        self.session.headers['X-CSRFToken'] = self.session.cookies.get('csrftoken')
+        self.session.headers['Referer'] = self.url('/')
+
+    def url(self, path):
+        return self.base_url + path
+
+    def get(self, path):
+        return self.session.get(self.url(path))
+
+    def post(self, path, data):
+        return self.session.post(self.url(path), json=data)
+
+
+class Scenarios:
+    """
+    Each scenario does any untimed setup (e.g. leasing a query before
+    answering it) and returns the timed request as a callable, or None if
+    the setup found nothing to do.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.anonymous = requests.Session()
+
+    def create(self):
+        return lambda: self.client.post('/queries/', {'text': 'Load test query: yes or no?', 'regex': 'yes|no', 'bid': 1})
+
+    def dispatch(self):
+        return lambda: self.client.get('/queries/get/')
+
+    def respond(self):
+        leased = self.client.get('/queries/get/')
+        if leased.status_code != 200:
+            return None
+        return lambda: self.client.post('/responses/', {'query': leased.json()['id'], 'text': 'yes'})
+
+    def profile(self):
+        return lambda: self.client.get('/profile/')
+
+    def deposit(self):
+        return lambda: self.client.post('/deposits/', {'stripeToken': 'tok_visa', 'amount': 1000})
+
+    def messenger(self):
+        return lambda: self.anonymous.post(self.client.url('/messenger/'), json={'entry': [{'messaging': [{
+            'sender': {'id': 'loadtest'},
+            'timestamp': int(time.time() * 1000),
+            'message': {'mid': 'mid.{}'.format(uuid.uuid4().hex), 'text': 'help'},
+        }]}]})
+
+
+def percentile(latencies, q):
+    return latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else float('nan')
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives the API of a running server with concurrent clients and reports throughput and p50/p95/p99 latency '
+        'per scenario. Seed users first with seed_data. By default it also starts fake Stripe and Graph API servers; '
+        'start the server under test with STRIPE_API_BASE and MESSENGER_GRAPH_URL pointing at them '
+        '(and SECURE_SSL_REDIRECT=False when serving plain HTTP).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated, from: {}.'.format(', '.join(SCENARIOS)))
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients, each logged in as its own seeded user.')
+        parser.add_argument('--requests', type=int, default=1000, help='Timed requests per scenario.')
+        parser.add_argument('--prefix', default='loadtest')
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--stripe-port', type=int, default=12111)
+        parser.add_argument('--graph-port', type=int, default=12112)
+        parser.add_argument('--no-fake-services', action='store_false', dest='fake_services')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON, e.g. for comparing releases.')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+
+        with ExitStack() as stack:
+            if options['fake_services']:
+                stripe = stack.enter_context(fakes.StubServer(fakes.stripe, options['stripe_port']))
+                graph = stack.enter_context(fakes.StubServer(fakes.graph, options['graph_port']))
+                self.stderr.write('Fake Stripe on {}, fake Graph API on {}'.format(stripe.url, graph.url))
+
+            workers = [
+                Scenarios(Client(options['base_url'], '{}-{}'.format(options['prefix'], i), options['password']))
+                for i in range(options['concurrency'])
+            ]
+
+            results = {scenario: self.run(workers, scenario, options['requests']) for scenario in scenarios}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write('{:<10} {:>8} {:>8} {:>10} {:>9} {:>9} {:>9}'.format('scenario', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for scenario, result in results.items():
+            self.stdout.write('{:<10} {:>8} {:>8} {:>10.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                scenario, result['requests'], result['errors'], result['throughput'], result['p50'], result['p95'], result['p99'],
+            ))
+
+    def run(self, workers, scenario, count):
+        """
+        Runs count requests of one scenario spread over every worker.
+        """
+        def work(index):
+            worker = workers[index]
+            timings = []
+            for i in range(index, count, len(workers)):
+                request = getattr(worker, scenario)()
+                if request is None:
+                    continue
+                start = time.perf_counter()
+                resp = request()
+                timings.append((time.perf_counter() - start, resp.status_code < 400))
+            return timings
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(workers)) as executor:
+            timings = [timing for result in executor.map(work, range(len(workers))) for timing in result]
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency * 1000 for latency, ok in timings)
+        return {
+            'requests': len(timings),
+            'errors': sum(not ok for latency, ok in timings),
+            'throughput': len(timings) / elapsed,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+        }
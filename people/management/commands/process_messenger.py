@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from people.models import MessengerEvent
+from people import messenger, metrics
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Processes queued Messenger webhook events. Events from one sender are handled in order; '
+        'different senders are handled in parallel. Run a single instance of this command.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.MESSENGER_CONCURRENCY, help='Number of senders handled at once.')
+        parser.add_argument('--batch', type=int, default=500, help='Maximum number of events fetched per batch.')
+        parser.add_argument('--poll', type=float, default=0.5, help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit.')
+
+    def handle(self, *args, **options):
+        metrics.export('process_messenger')
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            while True:
+                start = time.time()
+                events = MessengerEvent.objects.filter(processed=False).order_by('timestamp', 'created')[:options['batch']]
+
+                senders = OrderedDict()
+                for event in events:
+                    senders.setdefault(event.sender, []).append(event)
+
+                processed = sum(executor.map(messenger.process, senders.values()))
+                purged = messenger.purge(options['batch'])
+
+                if purged:
+                    self.stdout.write('Deleted {} old events'.format(purged))
+                if processed:
+                    elapsed = time.time() - start
+                    self.stdout.write('Processed {} events from {} senders in {:.3f}s ({:.1f} events/s)'.format(
+                        processed, len(senders), elapsed, processed / elapsed,
+                    ))
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll'])
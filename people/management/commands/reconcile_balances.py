@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from people.models import Ledger
+
+
+class Command(BaseCommand):
+    help = 'Recomputes every balance from the raw tables and reports drift from the ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Overwrite drifted ledger rows with the recomputed balance.')
+
+    def handle(self, *args, **options):
+        drifted = 0
+
+        for user in User.objects.all().iterator():
+            with transaction.atomic():
+                ledger, _ = Ledger.objects.select_for_update().get_or_create(user=user)
+                expected = Ledger.compute(user)
+
+                if ledger.balance != expected:
+                    drifted += 1
+                    self.stdout.write('{}: ledger {} != computed {} (drift {})'.format(
+                        user.username, ledger.balance, expected, ledger.balance - expected,
+                    ))
+
+                    if options['fix']:
+                        ledger.balance = expected
+                        ledger.save()
+
+        if drifted == 0:
+            self.stdout.write(self.style.SUCCESS('No drift found.'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS('Fixed {} drifted balances.'.format(drifted)))
+        else:
+            self.stdout.write(self.style.WARNING('{} balances drifted. Re-run with --fix to correct them.'.format(drifted)))
@@ -0,0 +1,152 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from people.models import *
+
+from collections import Counter
+import random
+import uuid
+
+
+LANGUAGES = ('en', 'fr', 'de', 'es', 'pt', 'ja')
+SKILLS = ('labeling', 'transcription', 'translation', 'moderation')
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds the database with synthetic users, deposits, transfers, attributes, queries, responses, ratings and reputations '
+        'for load testing. Users are named <prefix>-<n> and share the password given by --password.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--queries', type=int, default=100000)
+        parser.add_argument('--answered', type=float, default=0.9, help='Fraction of queries that get a response.')
+        parser.add_argument('--rated', type=float, default=0.5, help='Fraction of responses that get a rating.')
+        parser.add_argument('--prefix', default='loadtest')
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, so runs are reproducible.')
+        parser.add_argument('--batch', type=int, default=5000, help='Rows inserted per bulk_create call.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch = options['batch']
+        self.balances = Counter()
+        self.rated = Counter()
+        self.satisfied = Counter()
+
+        users = self.create_users(options['users'], options['prefix'], options['password'])
+        self.create_money(users)
+        self.create_attributes(users)
+        self.create_queries(users, options['queries'], options['answered'], options['rated'])
+
+        with transaction.atomic():
+            for user_id, amount in self.balances.items():
+                Ledger.apply(user_id, amount)
+
+        # Every rating is made now, so it counts in full towards recent reputation
+        self.insert(Reputation, (Reputation(
+            user_id=user, rated=self.rated[user], satisfactory=self.satisfied[user],
+            recentRated=self.rated[user], recentSatisfactory=self.satisfied[user],
+        ) for user in users))
+
+        self.stdout.write(self.style.SUCCESS('Seeded {} users and {} queries.'.format(len(users), options['queries'])))
+
+    def insert(self, model, objects):
+        """
+        Bulk inserts objects from an iterable in batches, so memory stays flat
+        however many rows are generated.
+        """
+        batch, count = [], 0
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == self.batch:
+                model.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        model.objects.bulk_create(batch)
+        count += len(batch)
+        self.stdout.write('  {} {}'.format(count, model._meta.verbose_name_plural))
+
+    def create_users(self, count, prefix, password):
+        # Hashing once keeps seeding fast; every user shares the hash
+        password = make_password(password)
+        start = User.objects.filter(username__startswith=prefix + '-').count()
+        usernames = ['{}-{}'.format(prefix, start + i) for i in range(count)]
+
+        self.insert(User, (User(username=username, email='{}@example.com'.format(username), password=password) for username in usernames))
+        users = list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+
+        self.insert(Profile, (Profile(user_id=user) for user in users))
+        self.insert(Ledger, (Ledger(user_id=user) for user in users))
+        return users
+
+    def create_money(self, users):
+        def deposits():
+            for user in users:
+                for i in range(self.random.randint(1, 5)):
+                    amount = self.random.randint(1000, 100000)
+                    self.balances[user] += amount
+                    yield Deposit(id='seed_{}'.format(uuid.uuid4().hex), user_id=user, stripeToken='tok_seed', amount=amount, status=Deposit.SUCCEEDED)
+
+        def transfers():
+            for user in users:
+                for i in range(self.random.randint(0, 2)):
+                    amount = self.random.randint(100, 1000)
+                    self.balances[user] -= amount
+                    yield Transfer(id='seed_{}'.format(uuid.uuid4().hex), user_id=user, amount=amount, status=Transfer.SUCCEEDED)
+
+        self.insert(Deposit, deposits())
+        self.insert(Transfer, transfers())
+
+    def create_attributes(self, users):
+        def attributes():
+            for user in users:
+                yield Attribute(user_id=user, key='language', value=self.random.choice(LANGUAGES))
+                for skill in self.random.sample(SKILLS, self.random.randint(0, len(SKILLS))):
+                    yield Attribute(user_id=user, key='skill', value=skill)
+
+        self.insert(Attribute, attributes())
+
+    def create_queries(self, users, count, answered, rated):
+        responses, ratings = [], []
+
+        def queries():
+            for i in range(count):
+                requester = self.random.choice(users)
+                bid = self.random.randint(1, 10)
+                self.balances[requester] -= bid
+                query = Query(user_id=requester, text='Synthetic query {}: yes or no?'.format(i), regex='yes|no', bid=bid)
+
+                if self.random.random() < answered:
+                    worker = self.random.choice(users)
+                    self.balances[worker] += bid
+                    query.pending = False
+                    response = Response(user_id=worker, query_id=query.id, text=self.random.choice(('yes', 'no')))
+                    responses.append(response)
+
+                    if self.random.random() < rated:
+                        satisfactory = self.random.random() < 0.9
+                        self.rated[worker] += 1
+                        self.satisfied[worker] += satisfactory
+                        ratings.append(Rating(user_id=requester, response_id=response.id, satisfactory=satisfactory))
+
+                yield query
+
+        # Queries go in first in batches; their responses and ratings follow per batch
+        batch = []
+        for query in queries():
+            batch.append(query)
+            if len(batch) == self.batch:
+                self.flush(batch, responses, ratings)
+                batch = []
+        self.flush(batch, responses, ratings)
+
+    def flush(self, queries, responses, ratings):
+        Query.objects.bulk_create(queries)
+        Response.objects.bulk_create(responses)
+        Rating.objects.bulk_create(ratings)
+        self.stdout.write('  {} queries, {} responses, {} ratings'.format(len(queries), len(responses), len(ratings)))
+        del responses[:], ratings[:]
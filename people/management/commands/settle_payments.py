@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from people import metrics, settlement
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+
+class Command(BaseCommand):
+    help = 'Charges pending deposits and pays out pending transfers through Stripe, retrying transient errors with exponential backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.SETTLEMENT_CONCURRENCY, help='Number of Stripe calls in flight at once.')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to sleep when nothing is due.')
+        parser.add_argument('--once', action='store_true', help='Settle one batch of due payments and exit.')
+
+    def handle(self, *args, **options):
+        metrics.export('settle_payments')
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            while True:
+                settled = settlement.settle_due(executor, options['concurrency'] * 4, options['concurrency'])
+
+                for payment in settled:
+                    self.stdout.write('{} {} {} attempt {}: {}'.format(
+                        type(payment).__name__.lower(), payment.id, payment.amount, payment.attempts, payment.lastError or payment.status,
+                    ))
+
+                if options['once']:
+                    break
+                if not settled:
+                    time.sleep(options['poll'])
@@ -0,0 +1,214 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import *
+from .identities import Identity
+from . import dispatch, identities, metrics
+
+from pymessenger.bot import Bot
+
+from datetime import timedelta
+import json
+import logging
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+class MeteredBot(Bot):
+    """
+    Bot whose Send API calls are timed and give up after
+    MESSENGER_SEND_TIMEOUT, which pymessenger's own calls never do.
+    """
+    def send_raw(self, payload):
+        with metrics.timed('messenger', 'send'):
+            url = '{}/me/messages'.format(self.graph_url)
+            return requests.post(url, params=self.auth_args, json=payload, timeout=settings.MESSENGER_SEND_TIMEOUT).json()
+
+
+bot = MeteredBot(settings.ACCESS_TOKEN)
+if settings.MESSENGER_GRAPH_URL:
+    bot.graph_url = settings.MESSENGER_GRAPH_URL
+
+
+def events(payload):
+    """
+    Yields the messaging events in a webhook payload, skipping any part of
+    it that isn't shaped like one, since Facebook would redeliver it forever.
+    """
+    entries = payload.get('entry') if isinstance(payload, dict) else None
+    for entry in entries if isinstance(entries, list) else []:
+        messaging = entry.get('messaging') if isinstance(entry, dict) else None
+        for message in messaging if isinstance(messaging, list) else []:
+            if valid(message):
+                yield message
+            else:
+                logger.warning('Skipping malformed messaging event: %r', message)
+
+
+def valid(message):
+    """
+    Whether a messaging event has what enqueue and process rely on.
+    """
+    if not isinstance(message, dict) or not isinstance(message.get('sender'), dict):
+        return False
+    if not isinstance(message['sender'].get('id'), (str, int)) or not isinstance(message.get('timestamp', 0), int):
+        return False
+    return all(isinstance(message.get(key, {}), dict) for key in ('message', 'account_linking'))
+
+
+def enqueue(message):
+    """
+    Persists a raw webhook messaging event for the process_messenger worker.
+    Redeliveries of an event that was already stored are ignored.
+    """
+    sender_id = message.get('sender').get('id')
+    timestamp = message.get('timestamp') or 0
+
+    if message.get('message') and message.get('message').get('mid'):
+        id = message.get('message').get('mid')
+    else:
+        id = '{}:{}:{}'.format(sender_id, timestamp, ','.join(sorted(message)))
+
+    _, created = MessengerEvent.objects.get_or_create(id=id, defaults={
+        'sender': sender_id,
+        'timestamp': timestamp,
+        'payload': json.dumps(message),
+    })
+    return created
+
+
+def identify(sender_id):
+    """
+    Returns the Identity of the account linked to a sender, or None.
+    """
+    def load():
+        row = Profile.objects.filter(messengerId=sender_id).values_list('id', 'user_id', 'user__username', 'currentQueryId').first()
+        return Identity(*row) if row != None else None
+    return identities.senders.get(sender_id, load)
+
+
+def set_current_query(sender_id, identity, query_id):
+    Profile.objects.filter(id=identity.profileId).update(currentQueryId=query_id)
+    identities.senders.put(sender_id, identity._replace(currentQueryId=query_id))
+
+
+def handle(message):
+    """
+    Acts on a single messaging event from the webhook.
+    """
+    sender_id = message.get('sender').get('id')
+
+    if message.get('message'):
+
+        text = message.get('message').get('text')
+
+        responded_to_query = False
+        # See if the sender is a logged in user and, if so, has a current query to be answered
+        identity = identify(sender_id)
+        if identity != None and identity.currentQueryId != None:
+            try:
+                query = Query.objects.get(id=identity.currentQueryId)
+                with transaction.atomic():
+                    Response.objects.create(user_id=identity.userId, query=query, text=text)
+                    set_current_query(sender_id, identity, None)
+
+                bot.send_text_message(sender_id, "Thanks! You've been credited {} cents.".format(query.bid))
+                responded_to_query = True
+            except Exception as e:
+                pass
+
+        if responded_to_query:
+            pass
+
+        elif text == 'help':
+            bot.send_text_message(sender_id, 'Hello! Try sending some of the following to interact with our system.\n\nregister\nlogin\nlogout\nget')
+
+        elif text == 'register':
+            bot.send_button_message(
+                sender_id, 'Click here to register.', [{
+                        'type': 'web_url',
+                        'url': 'https://people-api-server.herokuapp.com/messenger-register/',
+                        'title': 'Register',
+                    }]
+                )
+
+        elif text == 'login':
+            bot.send_button_message(
+                sender_id, 'Welcome! Click here to login.', [{
+                        'type': 'account_link',
+                        'url': 'https://people-api-server.herokuapp.com/messenger-login/',
+                    }]
+                )
+
+        elif text == 'logout':
+            bot.send_button_message(
+                sender_id, 'Sorry to see you go! Click here to logout.', [{
+                        'type': 'account_unlink'
+                    }]
+                )
+
+        elif text == 'get':
+            if identity == None:
+                bot.send_text_message(sender_id, 'Send login to link your account first.')
+                return
+
+            query = dispatch.lease(identity.userId)
+            if query is None:
+                bot.send_text_message(sender_id, 'No queries available right now, try again soon.')
+                return
+
+            set_current_query(sender_id, identity, query.id)
+
+            bot.send_text_message(sender_id, 'Here you go {}.\n\n{}'.format(identity.username, query.text))
+
+        else:
+            bot.send_text_message(sender_id, "Sorry, didn't quite understand that.")
+
+    elif message.get('account_linking'):
+        if message.get('account_linking').get('status') == 'linked':
+
+            auth_code = message.get('account_linking').get('authorization_code')
+
+            profile = Profile.objects.select_related('user').get(id=auth_code)
+            profile.messengerId = sender_id
+            profile.save()
+            identities.senders.put(sender_id, Identity(profile.id, profile.user_id, profile.user.username, profile.currentQueryId))
+
+            bot.send_text_message(sender_id, 'Welcome {}!'.format(profile.user.username))
+
+        else:
+
+            profile = Profile.objects.get(messengerId=sender_id)
+            profile.messengerId = None
+            profile.save()
+            identities.senders.put(sender_id, None)
+
+
+def process(events):
+    """
+    Handles one sender's events in order, marking each processed so it is
+    never handled twice.
+    """
+    for event in events:
+        try:
+            handle(json.loads(event.payload))
+        except Exception as e:
+            event.error = repr(e)
+
+        event.processed = True
+        event.save(update_fields=('processed', 'error'))
+
+    return len(events)
+
+
+def purge(limit):
+    """
+    Deletes up to limit processed events older than
+    MESSENGER_EVENT_RETENTION_DAYS and returns how many were deleted.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.MESSENGER_EVENT_RETENTION_DAYS)
+    ids = list(MessengerEvent.objects.filter(created__lt=cutoff, processed=True).values_list('id', flat=True)[:limit])
+    return MessengerEvent.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,124 @@
+"""
+Prometheus metrics for requests, database usage and calls to external
+services. Under gunicorn, set prometheus_multiproc_dir to a writable directory
+so that every worker's samples are aggregated on /metrics. Worker processes
+expose their own with export().
+"""
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess, push_to_gateway, start_http_server
+
+from contextlib import contextmanager
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    'people_request_duration_seconds', 'Request latency by view.',
+    ('view', 'method', 'status'), buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_QUERIES = Histogram(
+    'people_request_db_queries', 'Database queries issued per request by view.',
+    ('view',), buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+REQUEST_DB_LATENCY = Histogram(
+    'people_request_db_duration_seconds', 'Time spent in the database per request by view.',
+    ('view',), buckets=LATENCY_BUCKETS,
+)
+OUTBOUND_LATENCY = Histogram(
+    'people_outbound_duration_seconds', 'Latency of calls to external services.',
+    ('service', 'operation', 'outcome'), buckets=LATENCY_BUCKETS,
+)
+
+QUERIES_EXPIRED = Counter('people_queries_expired', 'Queries expired unanswered by the sweeper.')
+REFUNDED_CENTS = Counter('people_refunded_cents', 'Bids refunded to requesters for expired queries.')
+
+
+@contextmanager
+def timed(service, operation):
+    """
+    Records how long the wrapped call to an external service takes and
+    whether it raised.
+    """
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        OUTBOUND_LATENCY.labels(service, operation, outcome).observe(time.perf_counter() - start)
+
+
+def export(job):
+    """
+    Exposes the metrics of a worker process running job, e.g. settle_payments:
+    serves them on METRICS_PORT and pushes them to METRICS_PUSHGATEWAY_URL
+    every METRICS_PUSH_SECONDS and on exit, if either is set.
+    """
+    if settings.METRICS_PORT:
+        start_http_server(settings.METRICS_PORT)
+    if settings.METRICS_PUSHGATEWAY_URL:
+        threading.Thread(target=push_forever, args=(job,), name='metrics-push', daemon=True).start()
+        atexit.register(push, job)
+
+
+def push(job):
+    """
+    Pushes the process's metrics to the pushgateway once, grouped by job and
+    the dyno or host so that processes don't overwrite each other's.
+    """
+    instance = os.environ.get('DYNO') or socket.gethostname()
+    try:
+        push_to_gateway(settings.METRICS_PUSHGATEWAY_URL, job=job, registry=REGISTRY, grouping_key={'instance': instance})
+    except Exception:
+        logger.exception('Pushing metrics failed')
+
+
+def push_forever(job):
+    while True:
+        time.sleep(settings.METRICS_PUSH_SECONDS)
+        push(job)
+
+
+class QueryTimer:
+    """
+    Database execute wrapper that counts queries and the time spent on them.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+def view(request):
+    """
+    Exposes every metric in the Prometheus text format, optionally guarded by
+    METRICS_TOKEN.
+    """
+    if settings.METRICS_TOKEN and request.META.get('HTTP_AUTHORIZATION') != 'Bearer {}'.format(settings.METRICS_TOKEN):
+        return HttpResponseForbidden()
+
+    if 'prometheus_multiproc_dir' in os.environ or 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+
+from .metrics import QueryTimer, REQUEST_LATENCY, REQUEST_DB_QUERIES, REQUEST_DB_LATENCY
+from .throttling import route
+
+from collections import Counter
+from contextlib import ExitStack
+import threading
+import time
+
+
+class MetricsMiddleware:
+    """
+    Records latency, database query count and database time for every
+    request, labelled by the view that handled it.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+
+        REQUEST_LATENCY.labels(view, request.method, response.status_code).observe(time.perf_counter() - start)
+        REQUEST_DB_QUERIES.labels(view).observe(timer.count)
+        REQUEST_DB_LATENCY.labels(view).observe(timer.duration)
+
+        return response
+
+
+def shed_exempt(view):
+    """
+    Marks a view that LoadSheddingMiddleware always serves.
+    """
+    view.shed_exempt = True
+    return view
+
+
+def parks(request):
+    """
+    Whether a request holds its thread while it waits for something to
+    happen: a long-poll for queries or responses, or an event stream.
+    """
+    name = route(request)
+    if name in ('query-wait', 'query-events'):
+        return True
+    if name in ('query-get', 'query-lease'):
+        try:
+            return float(request.GET.get('wait', 0)) > 0
+        except ValueError:
+            return False
+    return False
+
+
+class LoadSheddingMiddleware:
+    """
+    Answers 503 Service Unavailable with Retry-After once this process is
+    serving MAX_CONCURRENT_REQUESTS requests, instead of letting more queue
+    behind them until they time out. Requests that park while they wait
+    are capped separately by MAX_PARKED_REQUESTS, so they can't take every
+    slot from the rest. Streamed responses count until they are closed.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.in_flight = Counter()
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.release(request)
+            raise
+
+        if response.streaming:
+            close = response.close
+
+            def closed():
+                try:
+                    close()
+                finally:
+                    self.release(request)
+            response.close = closed
+        else:
+            self.release(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, 'shed_exempt', False):
+            return None
+
+        if parks(request):
+            pool, limit = 'parked', settings.MAX_PARKED_REQUESTS
+        else:
+            pool, limit = 'active', settings.MAX_CONCURRENT_REQUESTS
+
+        with self.lock:
+            if self.in_flight[pool] < limit:
+                self.in_flight[pool] += 1
+                request.shed_pool = pool
+                return None
+
+        response = JsonResponse({'detail': 'Server is busy, try again later.'}, status=503)
+        response['Retry-After'] = settings.LOAD_SHED_RETRY_AFTER
+        return response
+
+    def release(self, request):
+        pool = getattr(request, 'shed_pool', None)
+        if pool != None:
+            request.shed_pool = None
+            with self.lock:
+                self.in_flight[pool] -= 1
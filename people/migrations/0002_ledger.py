@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_ledgers(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Ledger = apps.get_model('people', 'Ledger')
+    Deposit = apps.get_model('people', 'Deposit')
+    Transfer = apps.get_model('people', 'Transfer')
+    Query = apps.get_model('people', 'Query')
+    Response = apps.get_model('people', 'Response')
+
+    def total(queryset, field):
+        return queryset.aggregate(value=models.Sum(field))['value'] or 0
+
+    for user in User.objects.all():
+        Ledger.objects.create(user=user, balance=(
+            total(Deposit.objects.filter(user=user), 'amount')
+            + total(Response.objects.filter(user=user), 'query__bid')
+            - total(Transfer.objects.filter(user=user), 'amount')
+            - total(Query.objects.filter(user=user), 'bid')
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('people', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ledger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:39
+
+from django.db import migrations, models
+
+
+def close_answered_queries(apps, schema_editor):
+    Query = apps.get_model('people', 'Query')
+    Query.objects.filter(response__isnull=False).update(pending=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0002_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='query',
+            name='pending',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(close_answered_queries, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='query',
+            index=models.Index(fields=['pending', 'lastRetrieved', '-bid'], name='query_dispatch_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0003_query_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Callback',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('url', models.URLField()),
+                ('payload', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('delivered', 'Delivered'), ('dead', 'Dead')], default='pending', max_length=16)),
+                ('attempts', models.IntegerField(default=0)),
+                ('nextAttempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lastError', models.TextField(default=None, null=True)),
+                ('response', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='callback', to='people.Response')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='callback',
+            index=models.Index(fields=['status', 'nextAttempt'], name='callback_due_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0004_callback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessengerEvent',
+            fields=[
+                ('id', models.TextField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('sender', models.TextField()),
+                ('timestamp', models.BigIntegerField()),
+                ('payload', models.TextField()),
+                ('processed', models.BooleanField(default=False)),
+                ('error', models.TextField(default=None, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='messengerevent',
+            index=models.Index(fields=['processed', 'timestamp'], name='messengerevent_pending_idx'),
+        ),
+    ]
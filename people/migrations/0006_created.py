@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:45
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from datetime import timedelta
+
+
+def backfill_created(apps, schema_editor):
+    """
+    Gives existing rows distinct created times, since cursor pagination has
+    to count its way through rows that share one. Ratings take their
+    response's, and attributes are spaced a microsecond apart.
+    """
+    Attribute = apps.get_model('people', 'Attribute')
+    Rating = apps.get_model('people', 'Rating')
+    Response = apps.get_model('people', 'Response')
+
+    Rating.objects.update(created=models.Subquery(Response.objects.filter(id=models.OuterRef('response_id')).values('created')[:1]))
+
+    attributes = list(Attribute.objects.only('id', 'created').order_by('id'))
+    for i, attribute in enumerate(attributes):
+        attribute.created -= timedelta(microseconds=len(attributes) - i)
+    Attribute.objects.bulk_update(attributes, ['created'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0005_messengerevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attribute',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='rating',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+    ]
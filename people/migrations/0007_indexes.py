@@ -0,0 +1,69 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0006_created'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='callback',
+            name='callback_due_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='messengerevent',
+            name='messengerevent_pending_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='query',
+            name='query_dispatch_idx',
+        ),
+        migrations.AddIndex(
+            model_name='attribute',
+            index=models.Index(fields=['user', '-created', '-id'], name='attribute_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='callback',
+            index=models.Index(condition=models.Q(status='pending'), fields=['nextAttempt'], name='callback_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(fields=['user', '-created', '-id'], name='deposit_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messengerevent',
+            index=models.Index(condition=models.Q(processed=False), fields=['timestamp', 'created'], name='messengerevent_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(condition=models.Q(messengerId__isnull=False), fields=['messengerId'], name='profile_messenger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='query',
+            index=models.Index(condition=models.Q(pending=True), fields=['lastRetrieved', '-bid'], name='query_dispatch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='query',
+            index=models.Index(fields=['user', '-created', '-id'], name='query_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['user', '-created', '-id'], name='rating_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['user', '-created', '-id'], name='response_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['user', 'query'], name='response_user_query_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['user', '-created', '-id'], name='transfer_user_created_idx'),
+        ),
+    ]
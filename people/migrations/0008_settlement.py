@@ -0,0 +1,99 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:53
+
+from django.db import migrations, models
+import django.utils.timezone
+import people.models
+
+
+def settle_existing_payments(apps, schema_editor):
+    """
+    Deposits and transfers made before settlement moved off the request path
+    were created only after Stripe accepted them, keyed by the Stripe id.
+    """
+    for name in ('Deposit', 'Transfer'):
+        model = apps.get_model('people', name)
+        model.objects.update(status='succeeded', stripeId=models.F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0007_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deposit',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deposit',
+            name='grossAmount',
+            field=models.PositiveIntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='deposit',
+            name='lastError',
+            field=models.TextField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='deposit',
+            name='nextAttempt',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='deposit',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='deposit',
+            name='stripeId',
+            field=models.TextField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='lastError',
+            field=models.TextField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='nextAttempt',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='stripeId',
+            field=models.TextField(default=None, null=True),
+        ),
+        migrations.RunPython(settle_existing_payments, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='deposit',
+            name='id',
+            field=models.TextField(default=people.models.payment_id, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='id',
+            field=models.TextField(default=people.models.payment_id, primary_key=True, serialize=False),
+        ),
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(condition=models.Q(status='pending'), fields=['nextAttempt'], name='deposit_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(condition=models.Q(status='pending'), fields=['nextAttempt'], name='transfer_due_idx'),
+        ),
+    ]
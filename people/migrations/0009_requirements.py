@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0008_settlement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='query',
+            name='numRequirements',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Requirement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.TextField()),
+                ('value', models.TextField()),
+                ('query', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='requirements', to='people.Query')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='requirement',
+            index=models.Index(fields=['key', 'value', 'query'], name='requirement_match_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:04
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_reputations(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Reputation = apps.get_model('people', 'Reputation')
+    Rating = apps.get_model('people', 'Rating')
+    now = django.utils.timezone.now()
+
+    for user in User.objects.all():
+        reputation = Reputation(user=user, updated=now)
+        for satisfactory, created in Rating.objects.filter(response__user=user).values_list('satisfactory', 'created'):
+            weight = 0.5 ** ((now - created).total_seconds() / (settings.REPUTATION_HALF_LIFE_DAYS * 86400))
+            reputation.rated += 1
+            reputation.satisfactory += satisfactory
+            reputation.recentRated += weight
+            reputation.recentSatisfactory += satisfactory * weight
+        reputation.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('people', '0009_requirements'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='query',
+            name='minReputation',
+            field=models.FloatField(default=None, null=True, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]),
+        ),
+        migrations.CreateModel(
+            name='Reputation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rated', models.IntegerField(default=0)),
+                ('satisfactory', models.IntegerField(default=0)),
+                ('recentRated', models.FloatField(default=0)),
+                ('recentSatisfactory', models.FloatField(default=0)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reputation', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_reputations, migrations.RunPython.noop),
+    ]
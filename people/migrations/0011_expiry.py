@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('people', '0010_reputation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('amount', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='expired',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='query',
+            name='expires',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='query',
+            index=models.Index(condition=models.Q(('expires__isnull', False), ('pending', True)), fields=['expires'], name='query_expiry_idx'),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='query',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='refund', to='people.Query'),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0012_hold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deposit',
+            name='idempotencyKey',
+            field=models.CharField(default=None, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='transfer',
+            name='idempotencyKey',
+            field=models.CharField(default=None, max_length=255, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='deposit',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotencyKey'), name='deposit_idempotency_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='transfer',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotencyKey'), name='transfer_idempotency_key'),
+        ),
+    ]
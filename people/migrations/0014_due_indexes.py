@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0013_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='callback',
+            name='callback_due_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='deposit',
+            name='deposit_due_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transfer',
+            name='transfer_due_idx',
+        ),
+        migrations.AddIndex(
+            model_name='callback',
+            index=models.Index(fields=['status', 'nextAttempt'], name='callback_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deposit',
+            index=models.Index(fields=['status', 'nextAttempt'], name='deposit_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['status', 'nextAttempt'], name='transfer_due_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0014_due_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deposit',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('unknown', 'Unknown')], default='pending', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('unknown', 'Unknown')], default='pending', max_length=16),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:40
+
+from django.db import migrations
+
+
+def drop_closed_requirements(apps, schema_editor):
+    Requirement = apps.get_model('people', 'Requirement')
+    Requirement.objects.filter(query__pending=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0015_payment_unknown'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_closed_requirements, migrations.RunPython.noop),
+    ]
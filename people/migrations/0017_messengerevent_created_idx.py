@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0016_closed_requirements'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='messengerevent',
+            index=models.Index(fields=['created'], name='messengerevent_created_idx'),
+        ),
+    ]
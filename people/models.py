@@ -1,11 +1,26 @@
-from django.db import models
+from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
+from rest_framework.exceptions import ValidationError
+
+from . import caching, identities, notify
+
+from collections import Counter
+from contextlib import contextmanager
+import json
+import threading
 import uuid
 
 
+# Amounts held from each user's balance by this thread's open Ledger.hold blocks
+holds = threading.local()
+
+
 class Profile(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.OneToOneField(User, related_name='profile', unique=True, on_delete=models.CASCADE)
@@ -13,20 +28,13 @@ class Profile(models.Model):
     messengerId = models.TextField(null=True, default=None)
     currentQueryId = models.UUIDField(null=True, default=None)
 
-    def balance(self):
-        deposits = Deposit.objects.filter(user=self.user).aggregate(value=models.Sum('amount'))['value']
-        deposits = deposits if deposits != None else 0
-
-        transfers = Transfer.objects.filter(user=self.user).aggregate(value=models.Sum('amount'))['value']
-        transfers = transfers if transfers != None else 0
-
-        responses = Response.objects.filter(user=self.user).aggregate(value=models.Sum('query__bid'))['value']
-        responses = responses if responses != None else 0
+    class Meta:
+        indexes = [
+            models.Index(fields=['messengerId'], name='profile_messenger_idx', condition=models.Q(messengerId__isnull=False)),
+        ]
 
-        queries = Query.objects.filter(user=self.user).aggregate(value=models.Sum('bid'))['value']
-        queries = queries if queries != None else 0
-
-        return deposits + responses - transfers - queries
+    def balance(self):
+        return Ledger.objects.values_list('balance', flat=True).get(user_id=self.user_id)
 
 
 @receiver(post_save, sender=User)
@@ -36,6 +44,17 @@ def create_user_profile(sender, instance, created, **kwargs):
     """
     if created:
         Profile.objects.create(user=instance)
+        Ledger.objects.create(user=instance)
+        Reputation.objects.create(user=instance)
+
+
+@receiver(post_save, sender=Profile)
+def forget_identity(sender, instance, **kwargs):
+    """
+    Evicts the profile from the Messenger identity map, under both the
+    sender it was linked to and the one it's linked to now.
+    """
+    identities.senders.forget(instance.id, instance.messengerId)
 
 
 @receiver(post_save, sender=User)
@@ -46,27 +65,212 @@ def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
 
 
-class Deposit(models.Model):
-    id = models.TextField(primary_key=True)
-    created = models.DateTimeField(auto_now_add=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    stripeToken = models.TextField()
+class Ledger(models.Model):
+    """
+    Materialized balance of a user, kept in step with every Deposit, Transfer,
+    Query, Response and Refund write so that reads don't have to aggregate history.
+    """
+    user = models.OneToOneField(User, related_name='ledger', on_delete=models.CASCADE)
+    balance = models.IntegerField(default=0)
+
+    @staticmethod
+    def compute(user):
+        """
+        Recomputes a user's balance from the raw tables.
+        """
+        deposits = Deposit.objects.filter(user=user, status=Deposit.SUCCEEDED).aggregate(value=models.Sum('amount'))['value']
+        deposits = deposits if deposits != None else 0
+
+        transfers = Transfer.objects.filter(user=user).exclude(status=Transfer.FAILED).aggregate(value=models.Sum('amount'))['value']
+        transfers = transfers if transfers != None else 0
+
+        responses = Response.objects.filter(user=user).aggregate(value=models.Sum('query__bid'))['value']
+        responses = responses if responses != None else 0
+
+        queries = Query.objects.filter(user=user).aggregate(value=models.Sum('bid'))['value']
+        queries = queries if queries != None else 0
+
+        refunds = Refund.objects.filter(user=user).aggregate(value=models.Sum('amount'))['value']
+        refunds = refunds if refunds != None else 0
+
+        held = Hold.objects.filter(user=user).aggregate(value=models.Sum('amount'))['value']
+        held = held if held != None else 0
+
+        return deposits + responses + refunds - transfers - queries - held
+
+    @staticmethod
+    def apply(user_id, amount):
+        """
+        Adds amount (which may be negative) to a user's balance. Callers should
+        run this in the same transaction as the write it accounts for. Debits
+        are taken from the user's open hold first, if there is one.
+        """
+        held = getattr(holds, 'amounts', None)
+        if amount < 0 and held and held[user_id] > 0:
+            drawn = min(-amount, held[user_id])
+            held[user_id] -= drawn
+            amount += drawn
+            if amount == 0:
+                return
+        Ledger.objects.filter(user_id=user_id).update(balance=models.F('balance') + amount)
+
+    @staticmethod
+    def reserve(user_id, amount):
+        """
+        Takes amount from a user's balance if it covers it, raising
+        ValidationError otherwise, with one conditional update.
+        """
+        if not Ledger.objects.filter(user_id=user_id, balance__gte=amount).update(balance=models.F('balance') - amount):
+            raise ValidationError('Insufficient balance.')
+
+    @staticmethod
+    @contextmanager
+    def hold(user_id, amount):
+        """
+        Reserves amount of a user's balance as a Hold, then runs the block in
+        a transaction. Debits applied in the block are paid from the hold and
+        whatever is left of it afterwards is released, all of it if the block
+        raises.
+
+        The hold commits before the block runs, so concurrent requests from
+        one user can't overspend yet only wait on each other for that update,
+        not for the writes in the block. Ledger.compute counts the hold as
+        spent until the block commits, and release_holds returns holds a
+        crash leaves behind.
+        """
+        hold = Hold.take(user_id, amount)
+
+        if not hasattr(holds, 'amounts'):
+            holds.amounts = Counter()
+        before = holds.amounts[user_id]
+        try:
+            with transaction.atomic():
+                holds.amounts[user_id] += amount
+                yield
+                if not Hold.objects.filter(id=hold.id).delete()[0]:
+                    # Already released by release_holds, so nothing here was paid for
+                    raise ValidationError('Request took too long, try again.')
+                # Always updated, which locks the ledger row against reconcile_balances
+                Ledger.apply(user_id, max(holds.amounts[user_id] - before, 0))
+        except BaseException:
+            hold.release()
+            raise
+        finally:
+            holds.amounts[user_id] = min(holds.amounts[user_id], before)
+
+
+class Hold(models.Model):
+    """
+    Part of a user's balance reserved by Ledger.hold for a request that is
+    spending it. Its row is deleted in the same transaction as the spending,
+    so a hold that outlives its request was left behind by a crash.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, related_name='holds', on_delete=models.CASCADE)
     amount = models.PositiveIntegerField()
 
+    @staticmethod
+    def take(user_id, amount):
+        """
+        Takes amount from a user's balance and records it as a hold, raising
+        ValidationError if the balance doesn't cover it.
+        """
+        with transaction.atomic():
+            Ledger.reserve(user_id, amount)
+            return Hold.objects.create(user_id=user_id, amount=amount)
 
-class Transfer(models.Model):
-    id = models.TextField(primary_key=True)
+    def release(self):
+        """
+        Returns the hold to the user's balance unless that already happened.
+        """
+        with transaction.atomic():
+            if Hold.objects.filter(id=self.id).delete()[0]:
+                Ledger.apply(self.user_id, self.amount)
+                return True
+        return False
+
+
+def payment_id():
+    return uuid.uuid4().hex
+
+
+class Payment(models.Model):
+    """
+    Money moving through Stripe. Created pending on the request path and
+    settled by the settle_payments worker, which calls Stripe with the id as
+    idempotency key so retries never charge or pay out twice. Clients can
+    likewise retry creating one with the same idempotencyKey.
+
+    A payment whose retries all failed without Stripe saying whether it went
+    through is left unknown, to be reconciled against Stripe by hand: an
+    unknown deposit isn't credited and an unknown transfer isn't refunded.
+    """
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    UNKNOWN = 'unknown'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (UNKNOWN, 'Unknown'),
+    )
+
+    id = models.TextField(primary_key=True, default=payment_id)
     created = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     amount = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    stripeId = models.TextField(null=True, default=None)
+    attempts = models.IntegerField(default=0)
+    nextAttempt = models.DateTimeField(default=timezone.now)
+    lastError = models.TextField(null=True, default=None)
+    idempotencyKey = models.CharField(max_length=255, null=True, default=None)
+
+    class Meta:
+        abstract = True
+
+
+class Deposit(Payment):
+    stripeToken = models.TextField()
+    # What the card is charged; amount is what gets credited after fees
+    grossAmount = models.PositiveIntegerField(null=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='deposit_user_created_idx'),
+            models.Index(fields=['status', 'nextAttempt'], name='deposit_due_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotencyKey'], name='deposit_idempotency_key'),
+        ]
+
+
+class Transfer(Payment):
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='transfer_user_created_idx'),
+            models.Index(fields=['status', 'nextAttempt'], name='transfer_due_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotencyKey'], name='transfer_idempotency_key'),
+        ]
 
 
 class Attribute(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     key = models.TextField()
     value = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='attribute_user_created_idx'),
+        ]
+
 
 class Query(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -78,6 +282,49 @@ class Query(models.Model):
     callback = models.URLField(null=True, default=None)
     lastRetrieved = models.DateTimeField(null=True, default=None)
     numRetrievals = models.IntegerField(default=0)
+    pending = models.BooleanField(default=True)
+    # Number of Requirement rows, so matching a worker needs no count over them
+    numRequirements = models.IntegerField(default=0)
+    # Lowest Reputation.score of workers the query is handed to
+    minReputation = models.FloatField(null=True, default=None, validators=[MinValueValidator(0), MaxValueValidator(1)])
+    # Unanswered queries are taken out of the pool and refunded after this
+    expires = models.DateTimeField(null=True, default=None)
+    expired = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lastRetrieved', '-bid'], name='query_dispatch_idx', condition=models.Q(pending=True)),
+            models.Index(fields=['user', '-created', '-id'], name='query_user_created_idx'),
+            models.Index(fields=['expires'], name='query_expiry_idx', condition=models.Q(pending=True, expires__isnull=False)),
+        ]
+
+
+class Refund(models.Model):
+    """
+    Bid returned to the requester of a query that expired unanswered.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    query = models.OneToOneField(Query, related_name='refund', on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField()
+
+
+class Requirement(models.Model):
+    """
+    Attribute a worker must have to be handed a query. Indexed by (key, value)
+    so dispatch finds the queries a worker's attributes satisfy without
+    looking at any others. Only kept while the query is pending, so the rows
+    dispatch counts don't grow with history.
+    """
+    query = models.ForeignKey(Query, related_name='requirements', on_delete=models.CASCADE)
+    key = models.TextField()
+    value = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'value', 'query'], name='requirement_match_idx'),
+        ]
 
 
 class Response(models.Model):
@@ -87,10 +334,266 @@ class Response(models.Model):
     text = models.TextField()
     query = models.OneToOneField(Query, related_name='response', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='response_user_created_idx'),
+            # Lets balance reconciliation join to Query.bid from the index alone
+            models.Index(fields=['user', 'query'], name='response_user_query_idx'),
+        ]
+
+
+class Callback(models.Model):
+    """
+    Outbox entry for a response that still has to be POSTed to its query's
+    callback URL. Written in the same transaction as the response and
+    delivered by the deliver_callbacks worker.
+    """
+    PENDING = 'pending'
+    DELIVERED = 'delivered'
+    DEAD = 'dead'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (DELIVERED, 'Delivered'),
+        (DEAD, 'Dead'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
+    response = models.OneToOneField(Response, related_name='callback', on_delete=models.CASCADE)
+    url = models.URLField()
+    payload = models.TextField()
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    nextAttempt = models.DateTimeField(default=timezone.now)
+    lastError = models.TextField(null=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'nextAttempt'], name='callback_due_idx'),
+        ]
+
+    @staticmethod
+    def build(response, query):
+        return Callback(response=response, url=query.callback, payload=json.dumps({
+            'id': str(response.id),
+            'query': str(query.id),
+            'text': response.text,
+        }))
+
+
+class MessengerEvent(models.Model):
+    """
+    Raw Messenger webhook event, stored so the webhook can acknowledge it
+    immediately and processed later by the process_messenger worker. Keyed by
+    message id so redeliveries are dropped.
+    """
+    id = models.TextField(primary_key=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sender = models.TextField()
+    timestamp = models.BigIntegerField()
+    payload = models.TextField()
+    processed = models.BooleanField(default=False)
+    error = models.TextField(null=True, default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'created'], name='messengerevent_pending_idx', condition=models.Q(processed=False)),
+            models.Index(fields=['created'], name='messengerevent_created_idx'),
+        ]
+
 
 class Rating(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     satisfactory = models.BooleanField(default=True)
     response = models.OneToOneField(Response, related_name='rating', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='rating_user_created_idx'),
+        ]
+
+
+class Reputation(models.Model):
+    """
+    Counters of the ratings a worker's responses received, updated as ratings
+    are created and deleted. The recent counters decay with a half life of
+    REPUTATION_HALF_LIFE_DAYS, as of updated, so they weigh recent ratings
+    most without keeping a window of them.
+    """
+    user = models.OneToOneField(User, related_name='reputation', on_delete=models.CASCADE)
+    rated = models.IntegerField(default=0)
+    satisfactory = models.IntegerField(default=0)
+    recentRated = models.FloatField(default=0)
+    recentSatisfactory = models.FloatField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    @staticmethod
+    def weight(created, now):
+        """
+        Returns how much a rating made at created still counts at now.
+        """
+        return 0.5 ** ((now - created).total_seconds() / (settings.REPUTATION_HALF_LIFE_DAYS * 86400))
+
+    @staticmethod
+    def record(user_id, satisfactory, created, sign=1):
+        """
+        Adds (or with sign=-1 removes) a rating made at created to a worker's
+        counters. Callers should run this in the same transaction as the
+        rating write it accounts for.
+        """
+        with transaction.atomic():
+            reputation = Reputation.objects.select_for_update().get(user_id=user_id)
+            now = max(timezone.now(), reputation.updated)
+            decay = Reputation.weight(reputation.updated, now)
+            weight = Reputation.weight(created, now)
+
+            reputation.rated += sign
+            reputation.satisfactory += sign * satisfactory
+            # Clamped, as removals can overshoot slightly through rounding
+            reputation.recentRated = max(reputation.recentRated * decay + sign * weight, 0)
+            reputation.recentSatisfactory = max(reputation.recentSatisfactory * decay + sign * satisfactory * weight, 0)
+            reputation.updated = now
+            reputation.save()
+
+    def ratio(self):
+        return self.satisfactory / self.rated if self.rated else None
+
+    def recent_ratio(self):
+        return self.recentSatisfactory / self.recentRated if self.recentRated else None
+
+    def score(self):
+        """
+        The recent ratio as of now, with one satisfactory and one
+        unsatisfactory rating added so workers with few ratings start out at
+        0.5.
+        """
+        decay = Reputation.weight(self.updated, max(timezone.now(), self.updated))
+        return (self.recentSatisfactory * decay + 1) / (self.recentRated * decay + 2)
+
+
+
+@receiver(post_save, sender=Deposit)
+@receiver(post_save, sender=Transfer)
+@receiver(post_save, sender=Query)
+@receiver(post_save, sender=Response)
+@receiver(post_save, sender=Refund)
+def apply_ledger_entry(sender, instance, created, **kwargs):
+    if created:
+        Ledger.apply(*ledger_entry(instance))
+
+
+@receiver(post_delete, sender=Deposit)
+@receiver(post_delete, sender=Transfer)
+@receiver(post_delete, sender=Query)
+@receiver(post_delete, sender=Response)
+@receiver(post_delete, sender=Refund)
+def revert_ledger_entry(sender, instance, **kwargs):
+    user_id, amount = ledger_entry(instance)
+    Ledger.apply(user_id, -amount)
+
+
+def ledger_entry(instance):
+    """
+    Returns the (user_id, amount) an object contributes to its owner's balance.
+    Deposits count once their charge succeeds; transfers are held from the
+    moment they're requested and released if the payout fails.
+    """
+    if isinstance(instance, Deposit):
+        return instance.user_id, instance.amount if instance.status == Deposit.SUCCEEDED else 0
+    elif isinstance(instance, Transfer):
+        return instance.user_id, -instance.amount if instance.status != Transfer.FAILED else 0
+    elif isinstance(instance, Query):
+        return instance.user_id, -instance.bid
+    elif isinstance(instance, Response):
+        return instance.user_id, Query.objects.values_list('bid', flat=True).get(id=instance.query_id)
+    elif isinstance(instance, Refund):
+        return instance.user_id, instance.amount
+
+
+@receiver(post_save, sender=Query)
+@receiver(post_save, sender=Response)
+@receiver(post_save, sender=Deposit)
+@receiver(post_save, sender=Transfer)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Query)
+@receiver(post_delete, sender=Response)
+@receiver(post_delete, sender=Deposit)
+@receiver(post_delete, sender=Transfer)
+@receiver(post_delete, sender=Rating)
+def invalidate_cache(sender, instance, **kwargs):
+    for resource, user_id in cached_resources(instance):
+        caching.invalidate(resource, user_id)
+
+
+def cached_resources(instance):
+    """
+    Returns the (resource, user_id) pairs whose cached responses include an
+    object. A query's representation nests its response.
+    """
+    if isinstance(instance, Query):
+        return [('queries', instance.user_id)]
+    elif isinstance(instance, Response):
+        return [('responses', instance.user_id), ('queries', instance.query.user_id)]
+    elif isinstance(instance, Deposit):
+        return [('deposits', instance.user_id)]
+    elif isinstance(instance, Transfer):
+        return [('transfers', instance.user_id)]
+    elif isinstance(instance, Rating):
+        return [('ratings', instance.user_id)]
+
+
+@receiver(post_save, sender=Rating)
+def record_rating(sender, instance, created, **kwargs):
+    if created:
+        Reputation.record(instance.response.user_id, instance.satisfactory, instance.created)
+
+
+@receiver(post_delete, sender=Rating)
+def unrecord_rating(sender, instance, **kwargs):
+    Reputation.record(instance.response.user_id, instance.satisfactory, instance.created, sign=-1)
+
+
+@receiver(post_save, sender=Response)
+def close_query(sender, instance, created, **kwargs):
+    """
+    Takes an answered query out of the dispatch pool. Fails the response's
+    transaction if the query left the pool since it was validated, e.g. it
+    expired.
+    """
+    if not created:
+        return
+    if not Query.objects.filter(id=instance.query_id, pending=True).update(pending=False):
+        raise ValidationError({'query': ['Query is no longer open.']})
+    Requirement.objects.filter(query_id=instance.query_id).delete()
+
+
+@receiver(post_save, sender=Response)
+def enqueue_callback(sender, instance, created, **kwargs):
+    if created and instance.query.callback != None:
+        Callback.build(instance, instance.query).save()
+
+
+@receiver(post_save, sender=Query)
+def announce_query(sender, instance, created, **kwargs):
+    """
+    Wakes workers waiting for work.
+    """
+    if created:
+        notify.publish(notify.QUERIES)
+
+
+@receiver(post_save, sender=Response)
+def announce_response(sender, instance, created, **kwargs):
+    """
+    Wakes the requester's wait and event stream requests.
+    """
+    if created:
+        notify.publish(notify.responses(instance.query.user_id))
+
+
+@receiver(post_delete, sender=Response)
+def reopen_query(sender, instance, **kwargs):
+    Query.objects.filter(id=instance.query_id).update(pending=True)
+    notify.publish(notify.QUERIES)
@@ -0,0 +1,120 @@
+"""
+Wakes requests that are parked waiting for a change in the database, e.g. a
+response to a query. Changes are published on named channels once the
+transaction that made them commits. On Postgres they reach every process
+through LISTEN/NOTIFY; elsewhere only the publishing process is woken and
+waiters in other processes notice the change when they next re-check.
+"""
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+from collections import Counter
+import logging
+import select
+import threading
+import time
+
+
+CHANNEL = 'people'
+
+logger = logging.getLogger(__name__)
+condition = threading.Condition()
+versions = Counter()
+listener = None
+
+
+# Published whenever queries become available to workers
+QUERIES = 'queries'
+
+
+def responses(user_id):
+    """
+    Channel published whenever one of user_id's queries is answered.
+    """
+    return 'responses:{}'.format(user_id)
+
+
+def publish(channel):
+    """
+    Wakes everything waiting on channel once the current transaction commits.
+    """
+    if connection.vendor == 'postgresql':
+        # Postgres holds the notification back until commit by itself
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, channel])
+    transaction.on_commit(lambda: wake(channel))
+
+
+def wake(*channels):
+    with condition:
+        for channel in channels:
+            versions[channel] += 1
+        condition.notify_all()
+
+
+def wait(channels, check, timeout):
+    """
+    Calls check() until it returns something truthy or timeout seconds pass,
+    re-checking whenever one of channels is published and at least every
+    NOTIFY_POLL_SECONDS in case a notification was missed. Returns the last
+    result of check(). The thread's database connection is given back while
+    it waits, unless a transaction needs it.
+    """
+    listen()
+    deadline = time.monotonic() + timeout
+
+    while True:
+        with condition:
+            seen = [versions[channel] for channel in channels]
+
+        result = check()
+        remaining = deadline - time.monotonic()
+        if result or remaining <= 0:
+            return result
+
+        if not connection.in_atomic_block:
+            connection.close()
+        with condition:
+            condition.wait_for(
+                lambda: [versions[channel] for channel in channels] != seen,
+                min(remaining, settings.NOTIFY_POLL_SECONDS),
+            )
+
+
+def listen():
+    """
+    Starts this process's listener thread for notifications from other
+    processes, if the database supports them and it isn't running yet.
+    """
+    global listener
+    if connection.vendor != 'postgresql' or listener != None:
+        return
+
+    with condition:
+        if listener == None:
+            listener = threading.Thread(target=relay, name='notify-listener', daemon=True)
+            listener.start()
+
+
+def relay():
+    """
+    Relays Postgres notifications to local waiters, reconnecting whenever the
+    listening connection is lost.
+    """
+    wrapper = connections['default']
+    while True:
+        try:
+            conn = wrapper.get_new_connection(wrapper.get_connection_params())
+            conn.autocommit = True
+            conn.cursor().execute('LISTEN {}'.format(CHANNEL))
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                channels = [notification.payload for notification in conn.notifies]
+                del conn.notifies[:]
+                wake(*channels)
+        except Exception:
+            logger.exception('Notification listener failed, reconnecting')
+            time.sleep(1)
@@ -0,0 +1,55 @@
+"""
+One pooled aiohttp client per process for async views' calls to external
+services. It lives on its own event loop thread, so every view shares its
+connections whichever loop serves the view: ASGI runs one loop, while Django
+under WSGI starts a loop for each async request.
+"""
+from django.conf import settings
+
+import aiohttp
+import asyncio
+import atexit
+import threading
+
+
+lock = threading.Lock()
+loop = None
+client = None
+
+
+def start():
+    """
+    Returns the client's event loop, starting its thread on first use.
+    """
+    global loop
+    with lock:
+        if loop == None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='outbound', daemon=True).start()
+            atexit.register(stop)
+    return loop
+
+
+def stop():
+    if client != None:
+        asyncio.run_coroutine_threadsafe(client.close(), loop).result(5)
+
+
+async def post(url, data, timeout):
+    """
+    POSTs form data to url and returns the decoded JSON response, raising
+    aiohttp.ClientError for an error status and asyncio.TimeoutError after
+    timeout seconds.
+    """
+    future = asyncio.run_coroutine_threadsafe(post_on_loop(url, data, timeout), start())
+    return await asyncio.wrap_future(future)
+
+
+async def post_on_loop(url, data, timeout):
+    global client
+    if client == None:
+        # Only ever created and used on the client's own loop
+        client = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=settings.OUTBOUND_CONNECTIONS))
+    async with client.post(url, data=data, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+        resp.raise_for_status()
+        return await resp.json(content_type=None)
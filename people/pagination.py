@@ -0,0 +1,14 @@
+from django.conf import settings
+
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedCursorPagination(CursorPagination):
+    """
+    Keyset pagination, newest first, ordered on (created, id). Pages are
+    located by seeking to the last created timestamp seen, so the cost of a
+    page doesn't grow with how much history an account has.
+    """
+    ordering = ('-created', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
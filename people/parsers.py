@@ -0,0 +1,20 @@
+from django.conf import settings
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+import json
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON into a list of objects.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return [json.loads(line.decode(encoding)) for line in stream if line.strip()]
+        except ValueError as e:
+            raise ParseError('NDJSON parse error - {}'.format(e))
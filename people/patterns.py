@@ -0,0 +1,170 @@
+from django.conf import settings
+
+from functools import lru_cache
+import regex
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+REPEATS = tuple(getattr(sre_parse, op) for op in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') if hasattr(sre_parse, op))
+
+# How many times attacks() repeats a text an unbounded repeat matches, and
+# how many of those texts it tries per repeat
+PUMP_TIMES = 64
+MAX_SAMPLES = 8
+
+CATEGORY_SAMPLES = {
+    sre_parse.CATEGORY_DIGIT: '0',
+    sre_parse.CATEGORY_NOT_DIGIT: 'a',
+    sre_parse.CATEGORY_SPACE: ' ',
+    sre_parse.CATEGORY_NOT_SPACE: 'a',
+    sre_parse.CATEGORY_WORD: 'a',
+    sre_parse.CATEGORY_NOT_WORD: ' ',
+}
+
+
+@lru_cache(maxsize=settings.REGEX_CACHE_SIZE)
+def compile(pattern):
+    return regex.compile(pattern)
+
+
+@lru_cache(maxsize=settings.REGEX_CACHE_SIZE)
+def check(pattern):
+    """
+    Raises ValueError if a query regex is invalid or can backtrack
+    catastrophically, otherwise returns it compiled.
+    """
+    if len(pattern) > settings.REGEX_MAX_LENGTH:
+        raise ValueError('Regex must be at most {} characters.'.format(settings.REGEX_MAX_LENGTH))
+
+    try:
+        parsed = sre_parse.parse(pattern)
+        compiled = compile(pattern)
+    except Exception as e:
+        raise ValueError('Invalid regex: {}'.format(e))
+
+    if has_nested_repeat(parsed, False):
+        raise ValueError('Regex nests unbounded repeats, e.g. (a+)+, which can backtrack catastrophically.')
+
+    for text in attacks(parsed):
+        try:
+            compiled.fullmatch(text, timeout=settings.REGEX_TIMEOUT)
+        except TimeoutError:
+            raise ValueError('Regex repeats overlapping alternatives, e.g. (a|aa)+, which can backtrack catastrophically.')
+
+    return compiled
+
+
+def fullmatch(pattern, text):
+    """
+    Matches text against a query regex, raising TimeoutError if it takes longer
+    than REGEX_TIMEOUT seconds.
+    """
+    return compile(pattern).fullmatch(text, timeout=settings.REGEX_TIMEOUT)
+
+
+def has_nested_repeat(node, inside_unbounded):
+    """
+    Walks a parsed pattern looking for an unbounded repeat inside another,
+    the shape behind almost all exponential backtracking.
+    """
+    if isinstance(node, sre_parse.SubPattern):
+        return any(has_nested_repeat(item, inside_unbounded) for item in node)
+
+    if isinstance(node, (list, tuple)):
+        if len(node) == 2 and any(node[0] is op for op in REPEATS):
+            low, high, subpattern = node[1]
+            unbounded = high == sre_parse.MAXREPEAT
+            if inside_unbounded and unbounded:
+                return True
+            return has_nested_repeat(subpattern, inside_unbounded or unbounded)
+
+        return any(has_nested_repeat(item, inside_unbounded) for item in node)
+
+    return False
+
+
+def attacks(parsed):
+    """
+    Yields texts that make a regex backtrack catastrophically if any of its
+    unbounded repeats can match the same text more than one way, e.g.
+    (a|aa)+b: the repeat's body pumped PUMP_TIMES over inside an otherwise
+    matching text, then a character the regex can't end with.
+    """
+    for repeat in unbounded_repeats(parsed):
+        for pump in samples(repeat[1][2])[:MAX_SAMPLES]:
+            if pump:
+                yield sample(parsed, repeat, pump * PUMP_TIMES) + '\x00'
+
+
+def unbounded_repeats(node):
+    if isinstance(node, (sre_parse.SubPattern, list)):
+        for item in node:
+            yield from unbounded_repeats(item)
+    elif isinstance(node, tuple) and len(node) == 2:
+        if any(node[0] is op for op in REPEATS) and node[1][1] == sre_parse.MAXREPEAT:
+            yield node
+        for item in node[1] if isinstance(node[1], (tuple, list)) else ():
+            yield from unbounded_repeats(item)
+
+
+def sample(node, target=None, text=''):
+    """
+    Returns a short text the parsed node matches, with text in place of
+    whatever the target repeat matches.
+    """
+    return samples(node, target, text)[0]
+
+
+def samples(node, target=None, text=''):
+    """
+    Returns up to MAX_SAMPLES short texts the parsed node matches, one for
+    each way through its alternatives, first alternatives first.
+    """
+    if isinstance(node, (sre_parse.SubPattern, list)):
+        texts = ['']
+        for item in node:
+            texts = [a + b for a in texts for b in samples(item, target, text)][:MAX_SAMPLES]
+        return texts
+
+    op, av = node
+    if node is target:
+        return [text]
+    if op is sre_parse.LITERAL:
+        return [chr(av)]
+    if op is sre_parse.NOT_LITERAL:
+        return [chr(av + 1)]
+    if op is sre_parse.ANY:
+        return ['a']
+    if op is sre_parse.IN:
+        return [sample_in(av)]
+    if any(op is repeat for repeat in REPEATS):
+        low, high, subpattern = av
+        return [sampled * low for sampled in samples(subpattern, target, text)]
+    if op is sre_parse.BRANCH:
+        return [sampled for branch in av[1] for sampled in samples(branch, target, text)][:MAX_SAMPLES]
+    if op is sre_parse.SUBPATTERN:
+        return samples(av[-1], target, text)
+    if op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return samples(av, target, text)
+    if op is sre_parse.GROUPREF_EXISTS:
+        return samples(av[1], target, text)
+    # Anchors, lookarounds and backreferences match without text of their own here
+    return ['']
+
+
+def sample_in(items):
+    """
+    Returns a character in a character class.
+    """
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            return chr(av)
+        if op is sre_parse.RANGE:
+            return chr(av[0])
+        if op is sre_parse.CATEGORY:
+            return CATEGORY_SAMPLES.get(av, 'a')
+    return 'a'
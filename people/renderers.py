@@ -0,0 +1,49 @@
+from rest_framework.renderers import BaseRenderer
+
+from io import StringIO
+import csv
+import json
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets views that stream server-sent events be negotiated by EventSource
+    clients. Streams bypass the renderer, so this only renders errors, as an
+    error event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return 'event: error\ndata: {}\n\n'.format(json.dumps(data)).encode(self.charset)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Lets exports be negotiated with Accept: application/x-ndjson. Exports
+    stream past the renderer, so this only renders errors, as one line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return '{}\n'.format(json.dumps(data)).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Lets exports be negotiated with Accept: text/csv. Exports stream past the
+    renderer, so this only renders errors, in an error column.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        out = StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['error'])
+        writer.writerow([json.dumps(data)])
+        return out.getvalue().encode(self.charset)
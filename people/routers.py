@@ -0,0 +1,90 @@
+"""
+Sends the reads of read-only API requests to a replica database, keeping
+every write and everything else on the primary.
+
+Replicas lag the primary, so a user who wrote recently reads from the
+primary for REPLICA_STICKY_SECONDS afterwards. That way they always see
+their own writes, e.g. a query they just created or the balance after a
+deposit.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from rest_framework import permissions
+
+import random
+import threading
+import time
+
+
+state = threading.local()
+
+
+def wrote_key(user_id):
+    return 'wrote:{}'.format(user_id)
+
+
+def wrote(user_id):
+    """
+    Keeps user_id's reads on the primary until the replicas have caught up.
+    """
+    cache.set(wrote_key(user_id), time.time(), settings.REPLICA_STICKY_SECONDS)
+
+
+def replica_for(user_id):
+    """
+    Picks a replica for user_id's reads, or None if there are no replicas or
+    the user wrote too recently to read from one.
+    """
+    if not settings.DATABASE_REPLICAS or cache.get(wrote_key(user_id)) != None:
+        return None
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+def current():
+    """
+    The database this thread's reads currently go to.
+    """
+    return getattr(state, 'alias', None) or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    """
+    Routes reads to the replica chosen for the current request, if any.
+    Writes always go to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return getattr(state, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Reads from a replica during the views' replica_actions (or, for a plain
+    APIView, the lowercased methods it lists). Any other request that isn't
+    a safe method keeps its user on the primary for a while afterwards.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super(ReplicaReadMixin, self).initial(request, *args, **kwargs)
+
+        action = getattr(self, 'action', None) or request.method.lower()
+        if action in self.replica_actions:
+            state.alias = replica_for(request.user.id)
+        elif request.method not in permissions.SAFE_METHODS and request.user.is_authenticated:
+            wrote(request.user.id)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+        finally:
+            # Threads serve many requests, and an unhandled error skips finalize_response
+            state.alias = None
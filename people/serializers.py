@@ -1,9 +1,14 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 from .models import *
+from . import patterns
 
-import re
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -32,7 +37,8 @@ class DepositSerializer(serializers.ModelSerializer):
 class CreateDepositSerializer(serializers.ModelSerializer):
     class Meta:
         model = Deposit
-        fields = ('stripeToken', 'amount')
+        fields = ('id', 'status', 'stripeToken', 'amount')
+        read_only_fields = ('id', 'status')
 
 
 class TransferSerializer(serializers.ModelSerializer):
@@ -44,7 +50,8 @@ class TransferSerializer(serializers.ModelSerializer):
 class CreateTransferSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transfer
-        fields = ('amount',)
+        fields = ('id', 'status', 'amount')
+        read_only_fields = ('id', 'status')
 
 
 class AttributeSerializer(serializers.ModelSerializer):
@@ -65,9 +72,18 @@ class CreateResponseSerializer(serializers.ModelSerializer):
         fields = ('id', 'text', 'query')
 
     def validate(self, data):
+        if data['query'].expired:
+            raise serializers.ValidationError('Query has expired.')
+        if not data['query'].pending:
+            raise serializers.ValidationError('Query has already been answered.')
+
         text = data['text']
         regex = data['query'].regex
-        if not re.fullmatch(regex, text):
+        try:
+            matched = patterns.fullmatch(regex, text)
+        except TimeoutError:
+            raise serializers.ValidationError('Response text could not be matched against query regex r\'{}\' in time'.format(regex))
+        if not matched:
             raise serializers.ValidationError('Response text \'{}\' does not match query regex r\'{}\''.format(text, regex))
         return data
 
@@ -81,9 +97,47 @@ class QuerySerializer(serializers.ModelSerializer):
 
 
 class CreateQuerySerializer(serializers.ModelSerializer):
+    # Attribute key -> value a worker must have to be handed the query
+    requirements = serializers.DictField(child=serializers.CharField(), required=False, write_only=True)
+    # Seconds until the query expires if unanswered
+    ttl = serializers.IntegerField(min_value=1, max_value=settings.MAX_QUERY_TTL, required=False, write_only=True)
+
     class Meta:
         model = Query
-        fields = ('id', 'text', 'regex', 'callback', 'bid')
+        fields = ('id', 'text', 'regex', 'callback', 'bid', 'minReputation', 'requirements', 'ttl', 'expires')
+        read_only_fields = ('expires',)
+
+    def validate_regex(self, value):
+        try:
+            patterns.check(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_requirements(self, value):
+        if len(value) > settings.MAX_QUERY_REQUIREMENTS:
+            raise serializers.ValidationError('At most {} requirements are allowed.'.format(settings.MAX_QUERY_REQUIREMENTS))
+        return value
+
+    @staticmethod
+    def split(validated_data):
+        """
+        Returns the Query fields in validated_data, with numRequirements and
+        expires set, and the requirements.
+        """
+        fields = dict(validated_data)
+        requirements = fields.pop('requirements', {})
+        fields['numRequirements'] = len(requirements)
+        ttl = fields.pop('ttl', None)
+        if ttl != None:
+            fields['expires'] = timezone.now() + timedelta(seconds=ttl)
+        return fields, requirements
+
+    def create(self, validated_data):
+        fields, requirements = self.split(validated_data)
+        query = Query.objects.create(**fields)
+        Requirement.objects.bulk_create([Requirement(query=query, key=key, value=value) for key, value in requirements.items()])
+        return query
 
 
 class GetQuerySerializer(serializers.ModelSerializer):
@@ -103,3 +157,62 @@ class CreateRatingSerializer(serializers.ModelSerializer):
         model = Rating
         fields = ('id', 'satisfactory', 'response')
 
+    def validate_response(self, value):
+        if value.query.user != self.context['request'].user:
+            raise serializers.ValidationError('Only the user who made the query can rate its responses.')
+        return value
+
+
+class ReputationSerializer(serializers.ModelSerializer):
+    ratio = serializers.FloatField(read_only=True)
+    recentRatio = serializers.FloatField(source='recent_ratio', read_only=True)
+    score = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = Reputation
+        fields = ('user', 'rated', 'satisfactory', 'ratio', 'recentRatio', 'score', 'updated')
+
+
+class ValuesSerializer:
+    """
+    Read-only stand-in for a ModelSerializer that serializes rows of
+    QuerySet.values() instead of model instances, for large lists. It reuses
+    the serializer's own fields, built once, so the output is the same, but
+    skips the per-object serializer machinery. Nested model serializers are
+    read through related lookups in the same row.
+    """
+    def __init__(self, serializer_class, prefix=''):
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ModelSerializer):
+                self.fields.append((name, ValuesSerializer(type(field), prefix + field.source + '__')))
+            elif isinstance(field, serializers.RelatedField):
+                # values() gives the related primary key, which is what these render
+                self.fields.append((name, (prefix + field.source, lambda value: value)))
+            else:
+                self.fields.append((name, (prefix + field.source, field.to_representation)))
+        self.pk = prefix + 'id'
+
+    def keys(self):
+        return [key for name, field in self.fields for key in (field.keys() if isinstance(field, ValuesSerializer) else [field[0]])]
+
+    def to_representation(self, row):
+        if row[self.pk] == None:
+            return None
+
+        data = OrderedDict()
+        for name, field in self.fields:
+            if isinstance(field, ValuesSerializer):
+                data[name] = field.to_representation(row)
+            else:
+                key, to_representation = field
+                value = row[key]
+                data[name] = None if value == None else to_representation(value)
+        return data
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def of(serializer_class):
+        return ValuesSerializer(serializer_class)
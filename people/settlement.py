@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .models import Deposit, Transfer, Ledger, cached_resources, ledger_entry
+from . import caching, claims, metrics
+
+import logging
+import stripe
+
+
+logger = logging.getLogger(__name__)
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+if settings.STRIPE_API_BASE:
+    stripe.api_base = settings.STRIPE_API_BASE
+stripe.default_http_client = stripe.http_client.RequestsClient(timeout=settings.SETTLEMENT_TIMEOUT)
+
+# Errors Stripe will give again however often the request is retried
+PERMANENT_ERRORS = (
+    stripe.error.CardError,
+    stripe.error.InvalidRequestError,
+    stripe.error.AuthenticationError,
+    stripe.error.PermissionError,
+    stripe.error.IdempotencyError,
+)
+
+
+def claim_due(model, limit, lease):
+    """
+    Claims up to limit pending payments of a model that are due, hiding them
+    from other workers for lease while they're being settled.
+    """
+    due = model.objects.filter(status=model.PENDING, nextAttempt__lte=timezone.now()).order_by('nextAttempt')
+    return list(claims.claim(due, limit, lease).select_related('user__profile'))
+
+
+def charge(deposit):
+    with metrics.timed('stripe', 'charge'):
+        return stripe.Charge.create(
+            amount=deposit.grossAmount,
+            currency='usd',
+            source=deposit.stripeToken,
+            stripe_account=deposit.user.profile.stripeAccountId,
+            idempotency_key=deposit.id,
+        )
+
+
+def transfer(transfer):
+    with metrics.timed('stripe', 'transfer'):
+        return stripe.Transfer.create(
+            amount=transfer.amount,
+            currency='usd',
+            destination=transfer.user.profile.stripeAccountId,
+            idempotency_key=transfer.id,
+        )
+
+
+def settle(payment):
+    """
+    Makes the Stripe call for a payment once, then marks it succeeded or
+    failed, or schedules a retry with exponential backoff after a transient
+    error until SETTLEMENT_MAX_ATTEMPTS. Transient errors don't say whether
+    Stripe made the payment, so one that is still failing after that is
+    left unknown rather than failed.
+    """
+    status, stripe_id, error = payment.PENDING, None, None
+    try:
+        stripe_id = (charge if isinstance(payment, Deposit) else transfer)(payment).id
+        status = payment.SUCCEEDED
+    except PERMANENT_ERRORS as e:
+        status, error = payment.FAILED, str(e)
+    except stripe.error.StripeError as e:
+        error = str(e)
+        if payment.attempts + 1 >= settings.SETTLEMENT_MAX_ATTEMPTS:
+            status = payment.UNKNOWN
+            logger.error('%s %s needs reconciling with Stripe: %s', type(payment).__name__, payment.id, error)
+
+    try:
+        finish(payment, status, stripe_id, error)
+    finally:
+        connection.close_if_unusable_or_obsolete()
+
+    return payment
+
+
+def finish(payment, status, stripe_id, error):
+    """
+    Records the outcome of a settlement attempt and moves the owner's balance
+    by the difference it makes, e.g. crediting a deposit once it succeeds.
+    Only a payment that is still pending is updated, so an outcome is never
+    applied twice.
+    """
+    user_id, before = ledger_entry(payment)
+
+    payment.attempts += 1
+    payment.status = status
+    payment.stripeId = stripe_id
+    payment.lastError = error
+    if status == payment.PENDING:
+        payment.nextAttempt = timezone.now() + claims.backoff(
+            payment.attempts, settings.SETTLEMENT_BACKOFF_SECONDS, settings.SETTLEMENT_MAX_BACKOFF_SECONDS,
+        )
+
+    with transaction.atomic():
+        updated = type(payment).objects.filter(id=payment.id, status=payment.PENDING).update(
+            status=payment.status,
+            stripeId=payment.stripeId,
+            attempts=models.F('attempts') + 1,
+            lastError=payment.lastError,
+            nextAttempt=payment.nextAttempt,
+        )
+        if updated:
+            Ledger.apply(user_id, ledger_entry(payment)[1] - before)
+            for resource, owner in cached_resources(payment):
+                caching.invalidate(resource, owner)
+
+
+def settle_due(executor, limit, concurrency):
+    """
+    Settles a batch of up to limit due deposits and as many transfers on the
+    executor's concurrency threads and returns the payments that were
+    attempted.
+    """
+    lease = claims.lease(2 * limit, concurrency, settings.SETTLEMENT_TIMEOUT)
+    payments = claim_due(Deposit, limit, lease) + claim_due(Transfer, limit, lease)
+    return list(executor.map(settle, payments))
@@ -1,3 +1,1063 @@
-from django.test import TestCase
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
-# Create your tests here.
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from asgiref.sync import async_to_sync
+from prometheus_client import REGISTRY
+
+from .models import *
+from .serializers import QuerySerializer, ResponseSerializer, RatingSerializer
+from .fakes import StubServer
+from . import callbacks, dispatch, expiry, fakes, messenger, metrics, patterns, routers, settlement, throttling
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+import csv
+import importlib
+import json
+import re
+import stripe
+import threading
+import time
+
+
+class CallbackTests(TransactionTestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+
+    def respond(self, url):
+        query = Query.objects.create(user=self.requester, text='Yes or no?', regex='yes|no', callback=url)
+        return Response.objects.create(user=self.worker, query=query, text='yes')
+
+    def deliver(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return callbacks.deliver_due(executor, 10, 2)
+
+    def test_claims_batch_for_its_whole_delivery(self):
+        for i in range(3):
+            self.respond('http://example.com/')
+        start = timezone.now()
+
+        claimed = callbacks.claim_due(10, 2)
+        self.assertEqual(len(claimed), 3)
+        self.assertEqual(callbacks.claim_due(10, 2), [])
+        # Ten callbacks two at a time take five rounds, and one is spare
+        self.assertGreaterEqual(claimed[0].nextAttempt, start + timedelta(seconds=6 * settings.CALLBACK_TIMEOUT))
+
+    def test_delivers_response_to_callback_url(self):
+        with StubServer() as server:
+            response = self.respond(server.url + '/hook')
+            self.assertEqual(Callback.objects.get().status, Callback.PENDING)
+
+            self.deliver()
+
+        self.assertEqual(server.requests, [
+            ('POST', '/hook', {'id': str(response.id), 'query': str(response.query_id), 'text': 'yes'}),
+        ])
+        self.assertEqual(Callback.objects.get().status, Callback.DELIVERED)
+
+    @override_settings(CALLBACK_MAX_ATTEMPTS=2, CALLBACK_BACKOFF_SECONDS=0)
+    def test_retries_then_dead_letters_failing_callbacks(self):
+        with StubServer(lambda method, path, body: (500, {})) as server:
+            self.respond(server.url)
+
+            self.deliver()
+            callback = Callback.objects.get()
+            self.assertEqual((callback.status, callback.attempts), (Callback.PENDING, 1))
+
+            self.deliver()
+            callback = Callback.objects.get()
+            self.assertEqual((callback.status, callback.attempts), (Callback.DEAD, 2))
+
+            self.assertEqual(self.deliver(), [])
+
+        self.assertEqual(len(server.requests), 2)
+
+    def test_delivers_concurrently_from_event_loop(self):
+        delivered = []
+        with StubServer(lambda method, path, body: (500 if path == '/fail' else 200, {})) as server:
+            for path in ('/a', '/b', '/fail'):
+                self.respond(server.url + path)
+
+            async_to_sync(callbacks.deliver_concurrently)(3, 0.1, once=True, delivered=delivered.append)
+
+        self.assertEqual(sorted(path for method, path, body in server.requests), ['/a', '/b', '/fail'])
+        self.assertEqual(sorted(callback.status for callback in delivered), [Callback.DELIVERED, Callback.DELIVERED, Callback.PENDING])
+        failed = Callback.objects.get(url=server.url + '/fail')
+        self.assertEqual((failed.status, failed.attempts), (Callback.PENDING, 1))
+        self.assertTrue(failed.lastError)
+
+    def test_no_callback_without_url(self):
+        self.respond(None)
+        self.assertFalse(Callback.objects.exists())
+
+
+class MessengerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.worker = User.objects.create(username='worker')
+        self.worker.profile.messengerId = 'sender'
+        self.worker.profile.save()
+
+    def webhook(self, *messages):
+        return self.client.post('/messenger/', {
+            'entry': [{'messaging': list(messages)}],
+        }, content_type='application/json', secure=True)
+
+    def message(self, mid, text, timestamp):
+        return {'sender': {'id': 'sender'}, 'timestamp': timestamp, 'message': {'mid': mid, 'text': text}}
+
+    def test_acknowledges_then_processes_in_order_once(self):
+        query = Query.objects.create(user=User.objects.create(username='requester'), text='Yes or no?')
+
+        self.assertEqual(self.webhook(self.message('m1', 'get', 1), self.message('m2', 'yes', 2)).status_code, 200)
+        self.assertEqual(self.webhook(self.message('m2', 'yes', 2)).status_code, 200)
+        self.assertEqual(MessengerEvent.objects.count(), 2)
+        self.assertFalse(Response.objects.exists())
+
+        with StubServer() as server, mock.patch.object(messenger.bot, 'graph_url', server.url):
+            call_command('process_messenger', once=True, stdout=StringIO())
+
+        self.assertEqual(Response.objects.get().query, query)
+        self.assertEqual([body['message']['text'] for _, _, body in server.requests], [
+            'Here you go worker.\n\nYes or no?',
+            "Thanks! You've been credited 1 cents.",
+        ])
+        self.assertFalse(MessengerEvent.objects.filter(processed=False).exists())
+
+    def test_acknowledges_malformed_payloads(self):
+        with self.assertLogs('people.messenger', 'WARNING') as logs:
+            for body in ('[]', '{"entry": {}}', '{"entry": [{"messaging": [{"timestamp": 1}, "message"]}]}', '{'):
+                with self.subTest(body=body):
+                    resp = self.client.post('/messenger/', body, content_type='application/json', secure=True)
+                    self.assertEqual(resp.status_code, 200)
+
+            self.assertEqual(self.webhook({'timestamp': 1}, self.message('m1', 'get', 2)).status_code, 200)
+
+        self.assertEqual(len(logs.output), 3)
+        self.assertEqual(list(MessengerEvent.objects.values_list('id', flat=True)), ['m1'])
+
+    def test_identity_map_follows_account_linking(self):
+        Query.objects.create(user=User.objects.create(username='requester'), text='Yes or no?')
+        profile = User.objects.create(username='linker').profile
+
+        def linking(status, timestamp):
+            return {'sender': {'id': 'linker'}, 'timestamp': timestamp, 'account_linking': {'status': status, 'authorization_code': str(profile.id)}}
+
+        def process():
+            with StubServer() as server, mock.patch.object(messenger.bot, 'graph_url', server.url), CaptureQueriesContext(connection) as queries:
+                messenger.process(list(MessengerEvent.objects.filter(processed=False).order_by('timestamp')))
+            lookups = [query['sql'] for query in queries if 'FROM "people_profile"' in query['sql'] and '"messengerId" =' in query['sql']]
+            return [body['message'].get('text') for _, _, body in server.requests], lookups
+
+        self.webhook(linking('linked', 1), {'sender': {'id': 'linker'}, 'timestamp': 2, 'message': {'mid': 'm1', 'text': 'get'}})
+        self.webhook({'sender': {'id': 'linker'}, 'timestamp': 3, 'message': {'mid': 'm2', 'text': 'yes'}})
+        sent, lookups = process()
+        self.assertEqual(sent, ['Welcome linker!', 'Here you go linker.\n\nYes or no?', "Thanks! You've been credited 1 cents."])
+        self.assertEqual(lookups, [])
+        self.assertEqual(Response.objects.get().user.username, 'linker')
+
+        self.webhook(linking('unlinked', 4), {'sender': {'id': 'linker'}, 'timestamp': 5, 'message': {'mid': 'm3', 'text': 'get'}})
+        sent, lookups = process()
+        self.assertEqual(sent, ['Send login to link your account first.'])
+        self.assertEqual(len(lookups), 1)
+
+    @override_settings(MESSENGER_SEND_TIMEOUT=0.1)
+    def test_gives_up_on_hung_send_api_calls(self):
+        self.webhook(self.message('m1', 'get', 1), self.message('m2', 'get', 2))
+
+        def hang(method, path, body):
+            time.sleep(0.5)
+            return 200, {}
+
+        with StubServer(hang) as server, mock.patch.object(messenger.bot, 'graph_url', server.url):
+            call_command('process_messenger', once=True, stdout=StringIO())
+
+        self.assertEqual([error.split('(')[0] for error in MessengerEvent.objects.order_by('timestamp').values_list('error', flat=True)], ['ReadTimeout'] * 2)
+
+    def test_deletes_old_processed_events(self):
+        self.webhook(self.message('m1', 'get', 1), self.message('m2', 'get', 2), self.message('m3', 'get', 3))
+        MessengerEvent.objects.filter(id__in=('m1', 'm2')).update(processed=True)
+        MessengerEvent.objects.filter(id__in=('m2', 'm3')).update(created=timezone.now() - timedelta(days=settings.MESSENGER_EVENT_RETENTION_DAYS + 1))
+
+        self.assertEqual(messenger.purge(10), 1)
+        self.assertEqual(sorted(MessengerEvent.objects.values_list('id', flat=True)), ['m1', 'm3'])
+
+@override_settings(NOTIFY_POLL_SECONDS=30)
+class WaitTests(TransactionTestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+        self.queries = [Query.objects.create(user=self.requester, text=str(i)) for i in range(2)]
+        self.client.force_login(self.requester)
+
+    def answer_later(self, query):
+        def answer():
+            time.sleep(0.2)
+            Response.objects.create(user=self.worker, query=query, text='yes')
+        thread = threading.Thread(target=answer)
+        thread.start()
+        return thread
+
+    def test_wait_returns_when_answered(self):
+        thread = self.answer_later(self.queries[1])
+        start = time.monotonic()
+        resp = self.client.get('/queries/wait/', {'ids': ','.join(str(query.id) for query in self.queries), 'timeout': 10}, secure=True)
+        thread.join()
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([(query['id'], query['response']['text']) for query in resp.json()], [(str(self.queries[1].id), 'yes')])
+
+    def test_wait_times_out(self):
+        resp = self.client.get('/queries/wait/', {'ids': str(self.queries[0].id), 'timeout': 0.1}, secure=True)
+        self.assertEqual(resp.json(), [])
+
+    def test_worker_waits_for_work(self):
+        Response.objects.bulk_create([Response(user=self.worker, query=query, text='yes') for query in self.queries])
+        Query.objects.update(pending=False)
+        self.client.force_login(self.worker)
+        self.assertEqual(self.client.get('/queries/get/', secure=True).status_code, 404)
+
+        def submit():
+            time.sleep(0.2)
+            Query.objects.create(user=self.requester, text='New')
+        thread = threading.Thread(target=submit)
+        thread.start()
+        start = time.monotonic()
+        resp = self.client.get('/queries/get/', {'wait': 10}, secure=True)
+        thread.join()
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(resp.json()['text'], 'New')
+
+    @override_settings(SSE_MAX_SECONDS=1)
+    def test_event_stream(self):
+        resp = self.client.get('/queries/events/', HTTP_ACCEPT='text/event-stream', secure=True)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+
+        thread = self.answer_later(self.queries[0])
+        body = b''.join(resp.streaming_content).decode()
+        thread.join()
+
+        answer = Response.objects.get()
+        self.assertIn('id: {}\nevent: response\ndata: {}\n\n'.format(answer.id, json.dumps({
+            'id': str(answer.id), 'query': str(self.queries[0].id), 'text': 'yes',
+        })), body)
+
+
+@override_settings(SHARED_CACHE=True)
+class CachingTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+        self.query = Query.objects.create(user=self.requester, text='Yes or no?')
+        self.client.force_login(self.requester)
+
+    def get(self, path, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(path, secure=True, **headers)
+        return resp, [query['sql'] for query in queries if 'people_' in query['sql']]
+
+    def test_repeated_reads_skip_the_database(self):
+        for path in ('/queries/', '/queries/{}/'.format(self.query.id)):
+            with self.subTest(path=path):
+                first, queries = self.get(path)
+                self.assertEqual(first.status_code, 200)
+                self.assertTrue(queries)
+
+                cached, queries = self.get(path)
+                self.assertEqual((cached.status_code, cached.json(), queries), (200, first.json(), []))
+
+                not_modified, queries = self.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual((not_modified.status_code, not_modified['ETag'], queries), (304, first['ETag'], []))
+
+    def test_writes_invalidate(self):
+        first, _ = self.get('/queries/{}/'.format(self.query.id))
+        self.assertIsNone(first.json()['response'])
+
+        Response.objects.create(user=self.worker, query=self.query, text='yes')
+
+        resp, _ = self.get('/queries/{}/'.format(self.query.id), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['response']['text'], 'yes')
+        self.assertNotEqual(resp['ETag'], first['ETag'])
+
+    @override_settings(SHARED_CACHE=False)
+    def test_process_local_cache_is_not_used(self):
+        self.get('/queries/')
+        resp, queries = self.get('/queries/')
+        self.assertTrue(queries)
+        self.assertFalse(resp.has_header('ETag'))
+
+
+class SettlementTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        self.user.profile.stripeAccountId = 'acct_user'
+        self.user.profile.save()
+        self.client.force_login(self.user)
+
+    def settle(self, handle=fakes.stripe):
+        with StubServer(handle) as server, mock.patch.object(stripe, 'api_base', server.url):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                settlement.settle_due(executor, 10, 2)
+        return server
+
+    def test_deposit_is_credited_once_charged(self):
+        resp = self.client.post('/deposits/', {'stripeToken': 'tok_visa', 'amount': 1000}, secure=True)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.json()['status'], Deposit.PENDING)
+        self.assertEqual(self.user.profile.balance(), 0)
+
+        server = self.settle()
+
+        deposit = Deposit.objects.get()
+        self.assertEqual(deposit.status, Deposit.SUCCEEDED)
+        self.assertTrue(deposit.stripeId.startswith('ch_'))
+        self.assertEqual(server.requests[0][2]['amount'], '1000')
+        self.assertEqual(server.headers[0]['Idempotency-Key'], deposit.id)
+        self.assertEqual(self.user.profile.balance(), deposit.amount)
+        self.assertEqual(self.settle().requests, [])
+
+    def test_declined_deposit_fails(self):
+        self.client.post('/deposits/', {'stripeToken': 'tok_chargeDeclined', 'amount': 1000}, secure=True)
+
+        self.settle()
+
+        self.assertEqual(Deposit.objects.get().status, Deposit.FAILED)
+        self.assertEqual(self.user.profile.balance(), 0)
+
+    def test_rejected_transfer_is_refunded(self):
+        Deposit.objects.create(user=self.user, stripeToken='token', amount=500, status=Deposit.SUCCEEDED)
+        self.client.post('/transfers/', {'amount': 200}, secure=True)
+        self.assertEqual(self.user.profile.balance(), 300)
+
+        self.settle(lambda method, path, body: (400, {'error': {'type': 'invalid_request_error', 'message': 'Insufficient funds.'}}))
+
+        self.assertEqual(Transfer.objects.get().status, Transfer.FAILED)
+        self.assertEqual(self.user.profile.balance(), 500)
+        self.assertEqual(Ledger.compute(self.user), 500)
+
+    @override_settings(SETTLEMENT_MAX_ATTEMPTS=2, SETTLEMENT_BACKOFF_SECONDS=0)
+    def test_transfer_failing_transiently_is_retried_then_held_for_reconciling(self):
+        Deposit.objects.create(user=self.user, stripeToken='token', amount=500, status=Deposit.SUCCEEDED)
+        resp = self.client.post('/transfers/', {'amount': 200}, secure=True)
+        self.assertEqual(resp.json()['status'], Transfer.PENDING)
+        self.assertEqual(self.user.profile.balance(), 300)
+
+        unavailable = lambda method, path, body: (503, {'error': {'type': 'api_error', 'message': 'Unavailable.'}})
+        self.settle(unavailable)
+        self.assertEqual((Transfer.objects.get().status, Transfer.objects.get().attempts), (Transfer.PENDING, 1))
+        self.assertEqual(self.user.profile.balance(), 300)
+
+        # Stripe may have paid it out, so the amount isn't given back
+        with self.assertLogs('people.settlement', 'ERROR'):
+            self.settle(unavailable)
+        self.assertEqual(Transfer.objects.get().status, Transfer.UNKNOWN)
+        self.assertEqual(self.user.profile.balance(), 300)
+        self.assertEqual(Ledger.compute(self.user), 300)
+        self.assertEqual(self.settle().requests, [])
+
+    def test_retried_transfer_with_idempotency_key_is_created_once(self):
+        Deposit.objects.create(user=self.user, stripeToken='token', amount=500, status=Deposit.SUCCEEDED)
+        first = self.client.post('/transfers/', {'amount': 200}, HTTP_IDEMPOTENCY_KEY='key', secure=True)
+        retried = self.client.post('/transfers/', {'amount': 200}, HTTP_IDEMPOTENCY_KEY='key', secure=True)
+        self.assertEqual((first.status_code, retried.status_code), (201, 200))
+        self.assertEqual(retried.json()['id'], first.json()['id'])
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.assertEqual(self.user.profile.balance(), 300)
+
+        # Keys are per kind of payment, and requests without one are never replayed
+        self.assertEqual(self.client.post('/deposits/', {'stripeToken': 'tok_visa', 'amount': 1000}, HTTP_IDEMPOTENCY_KEY='key', secure=True).status_code, 201)
+        self.assertEqual(self.client.post('/transfers/', {'amount': 200}, secure=True).status_code, 201)
+        self.assertEqual(self.user.profile.balance(), 100)
+
+
+class BulkQueryTests(TestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        Deposit.objects.create(id='deposit', user=self.requester, stripeToken='token', amount=10, status=Deposit.SUCCEEDED)
+        self.client.force_login(self.requester)
+
+    def test_creates_valid_items_and_reports_errors(self):
+        resp = self.client.post('/queries/bulk/', [
+            {'text': 'One', 'bid': 3},
+            {'text': 'Two', 'regex': '(a+)+'},
+            {'text': 'Three', 'bid': 2},
+        ], content_type='application/json', secure=True)
+
+        self.assertEqual(resp.status_code, 201)
+        results = resp.json()
+        self.assertEqual(list(Query.objects.filter(id=results[0]['id']).values_list('text', flat=True)), ['One'])
+        self.assertIn('regex', results[1]['errors'])
+        self.assertEqual(list(Query.objects.filter(id=results[2]['id']).values_list('text', flat=True)), ['Three'])
+        self.assertEqual(self.requester.profile.balance(), 5)
+
+    def test_accepts_ndjson(self):
+        resp = self.client.post('/queries/bulk/', '{"text": "One"}\n{"text": "Two"}\n', content_type='application/x-ndjson', secure=True)
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(Query.objects.count(), 2)
+
+    def test_rejects_batch_over_balance(self):
+        resp = self.client.post('/queries/bulk/', [{'text': 'One', 'bid': 6}, {'text': 'Two', 'bid': 6}], content_type='application/json', secure=True)
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Query.objects.exists())
+        self.assertEqual(self.requester.profile.balance(), 10)
+
+
+class PatternTests(TestCase):
+
+    def test_rejects_regexes_that_backtrack_catastrophically(self):
+        for pattern in ('(a+)+', '(a|aa)+b', '(a|b|ab)*c'):
+            with self.subTest(pattern=pattern), self.assertRaises(ValueError):
+                patterns.check(pattern)
+
+        for pattern in ('yes|no', '(foo|bar)+', 'x(ab|a)+y', r'\d{3}-\d{4}'):
+            with self.subTest(pattern=pattern):
+                patterns.check(pattern)
+
+
+class RegisterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='worker')
+        self.client.force_login(self.user)
+
+    def test_links_stripe_account(self):
+        with StubServer(lambda method, path, body: (200, {'stripe_user_id': 'acct_1'})) as server, override_settings(STRIPE_CONNECT_URL=server.url):
+            resp = self.client.get('/register/', {'code': 'code'}, secure=True)
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(server.requests[0][:2], ('POST', '/oauth/token'))
+        self.assertEqual(server.requests[0][2]['code'], 'code')
+        self.assertEqual(Profile.objects.get(user=self.user).stripeAccountId, 'acct_1')
+
+    def test_reports_failed_exchange(self):
+        with StubServer(lambda method, path, body: (400, {'error': 'invalid_grant'})) as server, override_settings(STRIPE_CONNECT_URL=server.url):
+            resp = self.client.get('/register/', {'code': 'code'}, secure=True)
+
+        self.assertEqual(resp.status_code, 502)
+        self.assertEqual(Profile.objects.get(user=self.user).stripeAccountId, None)
+
+
+class HoldTests(TransactionTestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        Deposit.objects.create(user=self.requester, stripeToken='token', amount=100, status=Deposit.SUCCEEDED)
+
+    @override_settings(RATE_LIMIT=None, RATE_LIMIT_ROUTES={})
+    def test_parallel_spending_never_overspends(self):
+        statuses = []
+        # Errors come back as 500s: a client raising them would also pick up other threads' errors
+        clients = [self.client_class(raise_request_exception=False) for i in range(12)]
+        for client in clients:
+            client.force_login(self.requester)
+
+        def post(client, path, data):
+            # SQLite's shared cache fails rather than waits on another writer; Postgres waits
+            for attempt in range(200):
+                resp = client.post(path, data, content_type='application/json', secure=True)
+                error = resp.exc_info[1] if resp.exc_info else None
+                if not (isinstance(error, OperationalError) and 'locked' in str(error)):
+                    return resp
+                time.sleep(0.01)
+            return resp
+
+        def spend(i, client):
+            try:
+                for j in range(4):
+                    if (i + j) % 3 == 0:
+                        resp = post(client, '/transfers/', {'amount': 10})
+                    elif (i + j) % 3 == 1:
+                        resp = post(client, '/queries/', {'text': 'Yes or no?', 'bid': 10})
+                    else:
+                        resp = post(client, '/queries/bulk/', [{'text': 'One', 'bid': 5}, {'text': 'Two', 'bid': 5}])
+                    statuses.append(resp.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=spend, args=(i, client)) for i, client in enumerate(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # More was asked for than deposited, and no more than that was spent
+        self.assertEqual(sorted(set(statuses)), [201, 400])
+        with override_settings(HOLD_TIMEOUT=0):
+            expiry.release_holds(100)
+        self.assertGreaterEqual(self.requester.profile.balance(), 0)
+        self.assertEqual(self.requester.profile.balance(), Ledger.compute(self.requester))
+
+    def test_releases_hold_when_block_fails(self):
+        with self.assertRaises(ValueError):
+            with Ledger.hold(self.requester.id, 60):
+                Query.objects.create(user=self.requester, text='Yes or no?', bid=40)
+                raise ValueError()
+        self.assertEqual(self.requester.profile.balance(), 100)
+
+        with Ledger.hold(self.requester.id, 60):
+            Query.objects.create(user=self.requester, text='Yes or no?', bid=40)
+        self.assertEqual(self.requester.profile.balance(), 60)
+        self.assertEqual(Ledger.compute(self.requester), 60)
+        self.assertFalse(Hold.objects.exists())
+
+    def test_releases_holds_left_behind(self):
+        # As a crash between reserving and spending leaves it
+        Hold.take(self.requester.id, 60)
+        self.assertEqual(self.requester.profile.balance(), 40)
+        self.assertEqual(Ledger.compute(self.requester), 40)
+
+        self.assertEqual(expiry.release_holds(100), 0)
+        with override_settings(HOLD_TIMEOUT=0):
+            self.assertEqual(expiry.release_holds(100), 1)
+        self.assertEqual(self.requester.profile.balance(), 100)
+        self.assertEqual(Ledger.compute(self.requester), 100)
+
+
+class ReconcileTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        Deposit.objects.create(user=self.user, stripeToken='token', amount=100, status=Deposit.SUCCEEDED)
+        Query.objects.create(user=self.user, text='Yes or no?', bid=10)
+
+    def reconcile(self, **options):
+        out = StringIO()
+        call_command('reconcile_balances', stdout=out, **options)
+        return out.getvalue()
+
+    def test_reports_then_fixes_drift(self):
+        self.assertIn('No drift found.', self.reconcile())
+
+        Ledger.objects.filter(user=self.user).update(balance=150)
+        out = self.reconcile()
+        self.assertIn('user: ledger 150 != computed 90 (drift 60)', out)
+        self.assertIn('1 balances drifted', out)
+        self.assertEqual(self.user.profile.balance(), 150)
+
+        self.assertIn('Fixed 1 drifted balances.', self.reconcile(fix=True))
+        self.assertEqual(self.user.profile.balance(), 90)
+        self.assertIn('No drift found.', self.reconcile())
+
+
+class BatchWorkerTests(TestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+        self.queries = [
+            Query.objects.create(user=self.requester, text=str(i), regex='yes|no', bid=i + 1, callback='http://example.com/' if i == 0 else None)
+            for i in range(3)
+        ]
+        self.client.force_login(self.worker)
+
+    def test_leases_each_query_once(self):
+        leased = self.client.get('/queries/lease/?count=2&order=bid', secure=True).json()
+        self.assertEqual([query['bid'] for query in leased], [3, 2])
+
+        leased = self.client.get('/queries/lease/?count=2', secure=True).json()
+        self.assertEqual([query['bid'] for query in leased], [1])
+
+        self.assertEqual(self.client.get('/queries/lease/?count=2', secure=True).json(), [])
+        self.assertEqual(self.client.get('/queries/get/', secure=True).status_code, 404)
+
+    def test_answers_batch_with_per_item_results(self):
+        Response.objects.create(user=self.requester, query=self.queries[2], text='no')
+
+        resp = self.client.post('/responses/bulk/', [
+            {'query': str(self.queries[0].id), 'text': 'yes'},
+            {'query': str(self.queries[1].id), 'text': 'maybe'},
+            {'query': str(self.queries[2].id), 'text': 'yes'},
+            {'query': str(self.queries[1].id), 'text': 'no'},
+        ], content_type='application/json', secure=True)
+
+        self.assertEqual(resp.status_code, 201)
+        results = resp.json()
+        self.assertEqual(Response.objects.get(id=results[0]['id']).query, self.queries[0])
+        self.assertIn('non_field_errors', results[1]['errors'])
+        self.assertIn('query', results[2]['errors'])
+        self.assertEqual(Response.objects.get(id=results[3]['id']).query, self.queries[1])
+
+        self.assertEqual(self.worker.profile.balance(), 3)
+        self.assertEqual(self.worker.profile.balance(), Ledger.compute(self.worker))
+        self.assertFalse(Query.objects.filter(pending=True).exists())
+        self.assertEqual(Callback.objects.get().response.query, self.queries[0])
+
+
+class RoutingTests(TestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        Deposit.objects.create(user=self.requester, stripeToken='token', amount=10, status=Deposit.SUCCEEDED)
+        self.client.force_login(self.requester)
+
+    def worker(self, name, **attributes):
+        worker = User.objects.create(username=name)
+        for key, value in attributes.items():
+            Attribute.objects.create(user=worker, key=key, value=value)
+        return worker
+
+    def get(self, worker):
+        self.client.force_login(worker)
+        resp = self.client.get('/queries/get/', secure=True)
+        return resp.json()['text'] if resp.status_code == 200 else None
+
+    def test_only_matching_workers_get_targeted_queries(self):
+        resp = self.client.post('/queries/', {'text': 'Traduire?', 'requirements': {'language': 'fr', 'skill': 'translation'}}, content_type='application/json', secure=True)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(Query.objects.get().numRequirements, 2)
+
+        self.assertIsNone(self.get(self.worker('anyone')))
+        self.assertIsNone(self.get(self.worker('speaker', language='fr')))
+        self.assertIsNone(self.get(self.worker('english', language='en', skill='translation')))
+        self.assertEqual(self.get(self.worker('translator', language='fr', skill='translation')), 'Traduire?')
+
+    def test_untargeted_queries_go_to_anyone(self):
+        self.client.post('/queries/bulk/', [{'text': 'Anyone?'}, {'text': 'Hola?', 'requirements': {'language': 'es'}}], content_type='application/json', secure=True)
+
+        self.assertEqual(self.get(self.worker('anyone')), 'Anyone?')
+        self.assertEqual(self.get(self.worker('speaker', language='es')), 'Hola?')
+
+    def test_closed_queries_requirements_are_dropped(self):
+        self.client.post('/queries/bulk/', [
+            {'text': 'One?', 'requirements': {'language': 'es'}},
+            {'text': 'Two?', 'requirements': {'language': 'es'}},
+            {'text': 'Three?', 'requirements': {'language': 'es'}, 'ttl': 60},
+        ], content_type='application/json', secure=True)
+        one, two, three = (Query.objects.get(text=text) for text in ('One?', 'Two?', 'Three?'))
+
+        self.client.force_login(self.worker('speaker', language='es'))
+        self.assertEqual(Requirement.objects.count(), 3)
+        self.assertEqual(self.client.post('/responses/', {'query': one.id, 'text': 'Si'}, secure=True).status_code, 201)
+        self.assertIn('id', self.client.post('/responses/bulk/', [{'query': two.id, 'text': 'Si'}], content_type='application/json', secure=True).json()[0])
+        Query.objects.filter(id=three.id).update(expires=timezone.now())
+        self.assertEqual(expiry.expire(10)[0], 1)
+
+        self.assertEqual(Query.objects.filter(pending=True).count(), 0)
+        self.assertFalse(Requirement.objects.exists())
+
+
+class ReputationTests(TestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+        self.client.force_login(self.requester)
+
+    def rate(self, *satisfactory):
+        for value in satisfactory:
+            query = Query.objects.create(user=self.requester, text='Yes or no?')
+            response = Response.objects.create(user=self.worker, query=query, text='yes')
+            resp = self.client.post('/ratings/', {'response': response.id, 'satisfactory': value}, secure=True)
+            self.assertEqual(resp.status_code, 201)
+        return resp.json()['id']
+
+    def reputation(self):
+        return self.client.get('/reputations/{}/'.format(self.worker.id), secure=True).json()
+
+    def test_counts_ratings_as_they_are_created_and_deleted(self):
+        last = self.rate(True, True, False)
+        reputation = self.reputation()
+        self.assertEqual((reputation['rated'], reputation['satisfactory']), (3, 2))
+        self.assertAlmostEqual(reputation['recentRatio'], 2 / 3)
+        self.assertAlmostEqual(reputation['score'], 3 / 5)
+
+        self.client.delete('/ratings/{}/'.format(last), secure=True)
+        reputation = self.reputation()
+        self.assertEqual((reputation['rated'], reputation['satisfactory']), (2, 2))
+        self.assertAlmostEqual(reputation['recentRatio'], 1)
+
+    def test_only_the_requester_can_rate(self):
+        query = Query.objects.create(user=self.requester, text='Yes or no?')
+        response = Response.objects.create(user=self.worker, query=query, text='yes')
+        self.client.force_login(User.objects.create(username='other'))
+        resp = self.client.post('/ratings/', {'response': response.id, 'satisfactory': False}, secure=True)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.reputation()['rated'], 0)
+
+    def test_recent_ratio_favours_recent_ratings(self):
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(days=60)):
+            self.rate(False, False)
+        self.rate(True)
+
+        reputation = self.reputation()
+        self.assertAlmostEqual(reputation['ratio'], 1 / 3)
+        self.assertAlmostEqual(reputation['recentRatio'], 1 / 1.5)
+
+    def test_dispatch_enforces_minimum_reputation(self):
+        self.rate(False)
+        Query.objects.create(user=self.requester, text='Picky', minReputation=0.5)
+        Query.objects.create(user=self.requester, text='Anyone')
+
+        self.client.force_login(self.worker)
+        leased = self.client.get('/queries/lease/', {'count': 10}, secure=True).json()
+        self.assertEqual([query['text'] for query in leased], ['Anyone'])
+
+
+class ExpiryTests(TestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+        Deposit.objects.create(user=self.requester, stripeToken='token', amount=10, status=Deposit.SUCCEEDED)
+        self.client.force_login(self.requester)
+
+    def test_expires_and_refunds_in_bulk(self):
+        resp = self.client.post('/queries/bulk/', [{'text': 'Soon', 'bid': 3, 'ttl': 60}, {'text': 'Later', 'bid': 2, 'ttl': 3600}, {'text': 'Never', 'bid': 1}], content_type='application/json', secure=True)
+        soon, later, never = [Query.objects.get(id=result['id']) for result in resp.json()]
+        self.assertEqual(self.requester.profile.balance(), 4)
+
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=120)):
+            out = StringIO()
+            call_command('expire_queries', once=True, stdout=out)
+            self.assertIn('Expired 1 queries, refunded 3 cents', out.getvalue())
+
+            self.client.force_login(self.worker)
+            self.assertEqual([query['text'] for query in self.client.get('/queries/lease/', {'count': 10}, secure=True).json()], ['Later', 'Never'])
+            resp = self.client.post('/responses/', {'query': soon.id, 'text': 'Too late'}, secure=True)
+            self.assertEqual(resp.status_code, 400)
+
+        soon.refresh_from_db()
+        self.assertEqual((soon.pending, soon.expired), (False, True))
+        self.assertEqual(self.requester.profile.balance(), 7)
+        self.assertEqual(Ledger.compute(self.requester), 7)
+
+    def test_response_to_expired_query_is_rolled_back(self):
+        query = Query.objects.create(user=self.requester, text='Soon', expires=timezone.now())
+        Query.objects.filter(id=query.id).update(pending=False, expired=True)
+
+        with self.assertRaises(ValidationError), transaction.atomic():
+            Response.objects.create(user=self.worker, query=query, text='yes')
+        self.assertFalse(Response.objects.exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])  # Counts the default database's queries
+class ListTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+        for i in range(30):
+            query = Query.objects.create(user=self.requester, text=str(i), callback='http://example.com/' if i % 2 else None)
+            if i % 3:
+                response = Response.objects.create(user=self.worker, query=query, text='yes')
+                Rating.objects.create(user=self.requester, response=response)
+
+    def page(self, path, user, size):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(path, {'page_size': size}, secure=True)
+        return resp.json()['results'], len(queries)
+
+    def test_constant_queries_per_page(self):
+        for path, user in (('/queries/', self.requester), ('/responses/', self.worker), ('/ratings/', self.requester)):
+            with self.subTest(path=path):
+                small, few = self.page(path, user, 2)
+                large, many = self.page(path, user, 20)
+                self.assertEqual((len(small), len(large)), (2, 20))
+                self.assertEqual(few, many)
+
+    def test_matches_model_serializers(self):
+        for path, user, model, serializer in (
+                ('/queries/', self.requester, Query, QuerySerializer),
+                ('/responses/', self.worker, Response, ResponseSerializer),
+                ('/ratings/', self.requester, Rating, RatingSerializer)):
+            with self.subTest(path=path):
+                results, _ = self.page(path, user, 100)
+                expected = serializer(model.objects.filter(user=user).order_by('-created', '-id'), many=True).data
+                self.assertEqual(results, json.loads(json.dumps(expected, cls=JSONEncoder)))
+
+    def test_next_cursors_walk_every_item_once(self):
+        for path, user, model in (
+                ('/queries/', self.requester, Query),
+                ('/responses/', self.worker, Response),
+                ('/ratings/', self.requester, Rating)):
+            with self.subTest(path=path):
+                self.client.force_login(user)
+                ids, url = [], path + '?page_size=7'
+                while url:
+                    page = self.client.get(url, secure=True).json()
+                    ids += [item['id'] for item in page['results']]
+                    url = page['next']
+                expected = model.objects.filter(user=user).order_by('-created', '-id').values_list('id', flat=True)
+                self.assertEqual(ids, [str(id) for id in expected])
+
+    def test_backfill_spaces_out_legacy_created_times(self):
+        backfill = importlib.import_module('people.migrations.0006_created').backfill_created
+        tied = timezone.now()
+        for i in range(3):
+            Attribute.objects.create(user=self.worker, key='language', value=str(i))
+        Attribute.objects.update(created=tied)
+        Rating.objects.update(created=tied)
+
+        backfill(apps, None)
+
+        self.assertEqual(Attribute.objects.values('created').distinct().count(), 3)
+        self.assertFalse(Rating.objects.exclude(created=F('response__created')).exists())
+
+
+@override_settings(RATE_LIMIT=None, RATE_LIMIT_ROUTES={})
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.requester = User.objects.create(username='requester')
+        self.worker = User.objects.create(username='worker')
+        self.queries = [Query.objects.create(user=self.requester, text='Query, {}'.format(i)) for i in range(3)]
+        response = Response.objects.create(user=self.worker, query=self.queries[1], text='yes')
+        Rating.objects.create(user=self.requester, response=response, satisfactory=False)
+        Query.objects.create(user=self.worker, text='Not mine')
+        self.client.force_login(self.requester)
+
+    def export(self, accept='*/*', **params):
+        resp = self.client.get('/queries/export/', params, HTTP_ACCEPT=accept, secure=True)
+        self.assertEqual(resp.status_code, 200)
+        return resp['Content-Type'], b''.join(resp.streaming_content).decode()
+
+    def test_ndjson(self):
+        content_type, body = self.export()
+        rows = [json.loads(line) for line in body.splitlines()]
+
+        self.assertEqual(content_type, 'application/x-ndjson')
+        self.assertEqual([row['text'] for row in rows], ['Query, 0', 'Query, 1', 'Query, 2'])
+        self.assertEqual((rows[1]['responseText'], rows[1]['satisfactory']), ('yes', False))
+        self.assertEqual((rows[0]['response'], rows[0]['satisfactory']), (None, None))
+
+    def test_csv_with_filters(self):
+        content_type, body = self.export(type='csv', answered='false', created_after=self.queries[0].created.isoformat())
+        rows = list(csv.DictReader(StringIO(body)))
+
+        self.assertEqual(content_type, 'text/csv')
+        self.assertEqual([(row['id'], row['text'], row['response']) for row in rows], [
+            (str(self.queries[0].id), 'Query, 0', ''),
+            (str(self.queries[2].id), 'Query, 2', ''),
+        ])
+
+    def test_negotiates_type_from_accept(self):
+        for accept, content_type in (('text/csv', 'text/csv'), ('application/x-ndjson', 'application/x-ndjson')):
+            with self.subTest(accept=accept):
+                self.assertEqual(self.export(accept)[0], content_type)
+
+        resp = self.client.get('/queries/export/', {'type': 'xml'}, HTTP_ACCEPT='text/csv', secure=True)
+        self.assertEqual((resp.status_code, resp['Content-Type']), (400, 'text/csv; charset=utf-8'))
+
+
+class ReplicaTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='requester')
+
+    @override_settings(DATABASE_REPLICAS=['replica0'])
+    def test_reads_stick_to_primary_after_changes(self):
+        self.assertEqual(routers.replica_for(self.user.id), 'replica0')
+
+        Query.objects.create(user=self.user, text='Yes or no?', regex='yes|no')
+        self.assertEqual(routers.replica_for(self.user.id), None)
+
+        router = routers.ReplicaRouter()
+        routers.state.alias = 'replica0'
+        try:
+            self.assertEqual((router.db_for_read(Query), router.db_for_write(Query)), ('replica0', 'default'))
+        finally:
+            routers.state.alias = None
+        self.assertEqual(router.db_for_read(Query), None)
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'Set DATABASE_REPLICA_URLS, e.g. to sqlite:///replica.sqlite3')
+class ReplicaDatabaseTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='requester')
+        self.client.force_login(self.user)
+
+    def list_queries_from(self):
+        """
+        Lists the user's queries, returning the databases they were read from.
+        """
+        with CaptureQueriesContext(connections['default']) as default, CaptureQueriesContext(connections[self.replica]) as replica:
+            self.client.get('/queries/', secure=True)
+        return [alias for alias, queries in (('default', default), (self.replica, replica))
+                if any('people_query' in query['sql'] for query in queries)]
+
+    @override_settings(REPLICA_STICKY_SECONDS=60)
+    def test_lists_from_replica_unless_user_wrote_recently(self):
+        self.replica = settings.DATABASE_REPLICAS[0]
+        with override_settings(DATABASE_REPLICAS=[self.replica]):
+            self.assertEqual(self.list_queries_from(), [self.replica])
+
+            Query.objects.create(user=self.user, text='Yes or no?', regex='yes|no')
+            self.assertEqual(self.list_queries_from(), ['default'])
+
+
+@override_settings(DATABASE_REPLICAS=[])  # /profile/ would read the replica outside the test's transaction
+class RateLimitTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='requester')
+        self.client.force_login(self.user)
+
+    @override_settings(RATE_LIMIT_ROUTES={'profile': (1, 4)}, RATE_LIMIT_COSTS={'profile': 2})
+    def test_spends_route_cost_from_token_bucket(self):
+        statuses = [self.client.get('/profile/', secure=True).status_code for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+        throttled = self.client.get('/profile/', secure=True)
+        self.assertEqual((throttled.status_code, throttled['Retry-After']), (429, '2'))
+
+        # Other routes only draw on the bucket across all routes
+        self.assertEqual(self.client.get('/queries/', secure=True).status_code, 200)
+
+    def test_buckets_refill(self):
+        self.assertEqual(throttling.spend('bucket', 2, 100, 2), 0)
+        self.assertGreater(throttling.spend('bucket', 2, 100, 2), 0)
+        time.sleep(0.03)
+        self.assertEqual(throttling.spend('bucket', 2, 100, 2), 0)
+
+    @override_settings(MAX_CONCURRENT_REQUESTS=0)
+    def test_sheds_load_over_concurrency_limit(self):
+        resp = self.client.get('/profile/', secure=True)
+        self.assertEqual((resp.status_code, resp['Retry-After']), (503, '1'))
+
+        self.assertEqual(self.client.get('/metrics', secure=True).status_code, 200)
+
+    @override_settings(MAX_CONCURRENT_REQUESTS=0, MAX_PARKED_REQUESTS=1)
+    def test_parked_requests_have_their_own_limit(self):
+        self.assertEqual(self.client.get('/queries/get/?wait=0.01', secure=True).status_code, 404)
+        self.assertEqual(self.client.get('/queries/get/', secure=True).status_code, 503)
+
+        # An event stream holds its slot until it is closed
+        stream = self.client.get('/queries/events/', secure=True)
+        self.assertEqual(stream.status_code, 200)
+        self.assertEqual(self.client.get('/queries/get/?wait=0.01', secure=True).status_code, 503)
+        stream.close()
+        self.assertEqual(self.client.get('/queries/get/?wait=0.01', secure=True).status_code, 404)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        self.client.force_login(self.user)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_records_latency_and_queries_by_view(self):
+        Query.objects.create(user=self.user, text='Yes or no?')
+        labels = {'view': 'query-list'}
+        requests = self.sample('people_request_duration_seconds_count', method='GET', status='200', **labels)
+        queries = self.sample('people_request_db_queries_sum', **labels)
+
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get('/queries/', secure=True).status_code, 200)
+
+        self.assertEqual(self.sample('people_request_duration_seconds_count', method='GET', status='200', **labels), requests + 1)
+        self.assertEqual(self.sample('people_request_db_queries_sum', **labels), queries + len(captured))
+        self.assertEqual(self.sample('people_request_db_duration_seconds_count', **labels), self.sample('people_request_db_queries_count', **labels))
+
+    @override_settings(METRICS_TOKEN='token')
+    def test_exposes_metrics_to_token_holders(self):
+        self.client.get('/queries/', secure=True)
+
+        self.assertEqual(self.client.get('/metrics', secure=True).status_code, 403)
+        resp = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer token', secure=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('people_request_duration_seconds_bucket{', resp.content.decode())
+        self.assertIn('view="query-list"', resp.content.decode())
+
+    def test_workers_push_their_metrics(self):
+        metrics.QUERIES_EXPIRED.inc()
+        with StubServer() as server, override_settings(METRICS_PUSHGATEWAY_URL=server.url), mock.patch.dict('os.environ', {'DYNO': 'expiry.1'}):
+            metrics.push('expire_queries')
+
+        method, path, body = server.requests[0]
+        self.assertEqual((method, path), ('PUT', '/metrics/job/expire_queries/instance/expiry.1'))
+        self.assertIn('people_queries_expired', body)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN on each hot-path query and fails if any of them reads a
+    table without an index.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='user')
+        self.now = timezone.now()
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be scanned sequentially
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertNoFullScan(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertEqual(re.findall(r'Seq Scan on \w+', plan), [], plan)
+            return
+
+        # SQLite walks a partial index with SCAN even though it only holds the
+        # rows the filter wants, so only a SCAN of one of those is allowed
+        partial = [index.name for index in queryset.model._meta.indexes if index.condition != None]
+        reads = [line for line in plan.splitlines() if re.search(r'\b(SCAN|SEARCH) (TABLE )?people_', line)]
+        scans = [line for line in reads if re.search(r'\bSCAN\b', line) and not any(re.search(r'INDEX {}$'.format(name), line) for name in partial)]
+        self.assertEqual(scans, [], plan)
+        self.assertNotEqual(reads, [], plan)
+
+    def test_dispatch(self):
+        for attributes in (False, True):
+            if attributes:
+                Attribute.objects.create(user=self.user, key='language', value='fr')
+            for by_bid in (False, True):
+                with self.subTest(attributes=attributes, by_bid=by_bid):
+                    fresh, stale = dispatch.pending(self.user.id, self.now, by_bid)
+                    self.assertNoFullScan(fresh.values_list('id')[:16])
+                    self.assertNoFullScan(stale.values_list('id')[:16])
+
+    def test_messenger_sender_lookup(self):
+        self.assertNoFullScan(Profile.objects.filter(messengerId='sender'))
+
+    def test_owner_lists(self):
+        for model in (Deposit, Transfer, Attribute, Query, Response, Rating):
+            with self.subTest(model=model.__name__):
+                self.assertNoFullScan(model.objects.filter(user=self.user).order_by('-created', '-id')[:100])
+                self.assertNoFullScan(model.objects.filter(user=self.user, created__lt=self.now).order_by('-created', '-id')[:100])
+
+    def test_balance(self):
+        self.assertNoFullScan(Ledger.objects.filter(user=self.user))
+        self.assertNoFullScan(Response.objects.filter(user=self.user).values_list('query__bid'))
+
+    def test_workers(self):
+        self.assertNoFullScan(Callback.objects.filter(status=Callback.PENDING, nextAttempt__lte=self.now).order_by('nextAttempt')[:64])
+        self.assertNoFullScan(MessengerEvent.objects.filter(processed=False).order_by('timestamp', 'created')[:500])
+        self.assertNoFullScan(MessengerEvent.objects.filter(created__lt=self.now, processed=True).values_list('id')[:500])
+        self.assertNoFullScan(Query.objects.filter(pending=True, expires__lte=self.now).order_by('expires').values_list('id')[:1000])
+        for model in (Deposit, Transfer):
+            with self.subTest(model=model.__name__):
+                self.assertNoFullScan(model.objects.filter(status=model.PENDING, nextAttempt__lte=self.now).order_by('nextAttempt')[:32])
@@ -0,0 +1,98 @@
+"""
+Token bucket rate limits, kept in the cache so that every process spends
+from the same buckets when it is shared (Redis in production).
+
+Buckets are stored as their theoretical arrival time (GCRA): the time at
+which the bucket would be full again. Taking tokens pushes it later, and a
+request is turned away if that would put it more than the bucket's capacity
+ahead of now.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from rest_framework.throttling import BaseThrottle
+
+import math
+import threading
+import time
+
+
+SCRIPT = """
+local now, increment, tolerance = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or ARGV[1]), now)
+local wait = tat + increment - now - tolerance
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('SET', KEYS[1], tostring(tat + increment), 'PX', math.ceil((tat + increment - now) * 1000))
+return '0'
+"""
+
+lock = threading.Lock()
+script = None
+
+
+def route(request):
+    """
+    Names the route a request is for: the viewset's basename and action, e.g.
+    query-get for GET /queries/get/, or the URL's name, e.g. profile.
+    """
+    match = request.resolver_match
+    if match == None:
+        return None
+    actions = getattr(match.func, 'actions', None)
+    if actions:
+        return '{}-{}'.format(match.func.initkwargs['basename'], actions.get(request.method.lower()))
+    return match.url_name
+
+
+def spend(key, cost, rate, capacity):
+    """
+    Takes cost tokens from the bucket at key, which holds up to capacity
+    tokens and refills at rate per second. Returns 0 if they were taken,
+    otherwise how many seconds until they could be.
+    """
+    now, increment, tolerance = time.time(), cost / rate, capacity / rate
+
+    if settings.CACHES['default']['BACKEND'].startswith('django_redis'):
+        global script
+        if script == None:
+            from django_redis import get_redis_connection
+            script = get_redis_connection('default').register_script(SCRIPT)
+        return float(script(keys=[cache.make_key(key)], args=[repr(now), repr(increment), repr(tolerance)]))
+
+    # Any other cache is local to this process, which settings only allow off
+    # Heroku, and the lock makes this atomic
+    with lock:
+        tat = max(cache.get(key, now), now)
+        wait = tat + increment - now - tolerance
+        if wait > 0:
+            return wait
+        cache.set(key, tat + increment, math.ceil(tat + increment - now))
+        return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Spends a request's RATE_LIMIT_COSTS from the client's bucket for its
+    route, if RATE_LIMIT_ROUTES limits it, then from their bucket across all
+    routes. Users are limited by id, anonymous clients by address.
+    """
+    def allow_request(self, request, view):
+        name = route(request)
+        cost = settings.RATE_LIMIT_COSTS.get(name, 1)
+        if request.user.is_authenticated:
+            client = 'user:{}'.format(request.user.id)
+        else:
+            client = 'address:{}'.format(self.get_ident(request))
+
+        self.delay = 0
+        for bucket, limit in ((name, settings.RATE_LIMIT_ROUTES.get(name)), ('all', settings.RATE_LIMIT)):
+            if limit != None:
+                self.delay = spend('ratelimit:{}:{}'.format(bucket, client), cost, *limit)
+                if self.delay:
+                    return False
+        return True
+
+    def wait(self):
+        return self.delay
@@ -2,31 +2,131 @@ from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth.models import User
 from django.contrib.auth import views as auth_views
-from django.http import HttpResponse
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework import viewsets, mixins, permissions, response
 from rest_framework.decorators import action
-from rest_framework.renderers import TemplateHTMLRenderer
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer, TemplateHTMLRenderer
 from rest_framework.views import APIView
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ValidationError, NotFound, ParseError
+
+from asgiref.sync import sync_to_async
 
 from .models import *
 from .serializers import *
 from .filters import IsOwnerFilterBackend
+from .parsers import NDJSONParser
 from .permissions import IsOwnerOrReadOnly
+from .caching import CachedReadMixin
+from .renderers import CSVRenderer, EventStreamRenderer, NDJSONRenderer
+from .routers import ReplicaReadMixin
+from . import caching, dispatch, events, exports, messenger, metrics, notify, outbound, routers
 
-from datetime import datetime
+import aiohttp
+import asyncio
 import math
-from pymessenger import bot
-import random
-import requests
-import stripe
 
 import uuid
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-bot = bot.Bot(settings.ACCESS_TOKEN)
+def wait_seconds(request, name, default):
+    """
+    Parses how long a request may wait from a query parameter.
+    """
+    try:
+        seconds = float(request.query_params.get(name, default))
+    except ValueError:
+        raise ValidationError('{} must be a number of seconds.'.format(name))
+    if not 0 <= seconds <= settings.MAX_WAIT_SECONDS:
+        raise ValidationError('{} must be between 0 and {} seconds.'.format(name, settings.MAX_WAIT_SECONDS))
+    return seconds
+
+
+class ValuesListMixin:
+    """
+    Lists with ValuesSerializer, reading only the columns the serializer
+    shows, instead of building a model instance and serializer per row.
+    """
+    def list(self, request, *args, **kwargs):
+        serializer = ValuesSerializer.of(self.get_serializer_class())
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer.keys())
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response([serializer.to_representation(row) for row in page])
+
+
+class IdempotentCreateMixin:
+    """
+    Creates at most one object per Idempotency-Key header for each user, so
+    a client can safely retry a create whose response it didn't get. A retry
+    gets back the object the first request created. perform_create saves
+    idempotency_key() with the object.
+    """
+    def create(self, request, *args, **kwargs):
+        key = self.idempotency_key()
+        if key == None:
+            return super(IdempotentCreateMixin, self).create(request, *args, **kwargs)
+        if len(key) > 255:
+            raise ValidationError('Idempotency-Key must be at most 255 characters.')
+
+        try:
+            return self.replay(key) or super(IdempotentCreateMixin, self).create(request, *args, **kwargs)
+        except IntegrityError:
+            # A concurrent request with the same key created it first
+            replayed = self.replay(key)
+            if replayed == None:
+                raise
+            return replayed
+
+    def idempotency_key(self):
+        return self.request.META.get('HTTP_IDEMPOTENCY_KEY')
+
+    def replay(self, key):
+        instance = self.get_queryset().filter(user=self.request.user, idempotencyKey=key).first()
+        if instance == None:
+            return None
+        return response.Response(self.get_serializer(instance).data)
+
+
+class BulkCreateMixin:
+    """
+    Validates each item of a bulk create on its own, so that invalid items
+    are reported in the results without failing the rest of the batch.
+    """
+    def validate_bulk(self, name, limit):
+        """
+        Returns the serializer, the validated data of the valid items and the
+        errors of the others, both keyed by each item's index.
+        """
+        if not isinstance(self.request.data, list):
+            raise ValidationError('Expected a list of {}.'.format(name))
+        if len(self.request.data) > limit:
+            raise ValidationError('At most {} {} may be submitted at once.'.format(limit, name))
+
+        # One serializer validates every item, so its fields are only built once
+        serializer = self.get_serializer()
+        valid, errors = {}, {}
+        for index, item in enumerate(self.request.data):
+            try:
+                valid[index] = serializer.run_validation(item)
+            except ValidationError as e:
+                errors[index] = e.detail
+        return serializer, valid, errors
+
+    def bulk_results(self, created, errors):
+        """
+        Responds with the id of each created object, or the errors of each
+        item that wasn't created, in the order the items were submitted.
+        """
+        return response.Response([
+            {'id': created[index].id} if index in created else {'errors': errors[index]}
+            for index in range(len(self.request.data))
+        ], status=201)
 
 
 class UserViewSet(
@@ -39,9 +139,10 @@ class UserViewSet(
     permission_classes = (permissions.AllowAny,)
 
 
-class ProfileView(APIView):
+class ProfileView(ReplicaReadMixin, APIView):
 
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+    replica_actions = ('get',)
 
     def get(self, request):
         profile = Profile.objects.get(user=request.user)
@@ -65,6 +166,10 @@ class DepositView(APIView):
 
 
 class DepositViewSet(
+        ReplicaReadMixin,
+        CachedReadMixin,
+        ValuesListMixin,
+        IdempotentCreateMixin,
         mixins.ListModelMixin,
         mixins.RetrieveModelMixin,
         mixins.CreateModelMixin,
@@ -74,6 +179,7 @@ class DepositViewSet(
     queryset = Deposit.objects.all()
     filter_backends = (IsOwnerFilterBackend,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+    cache_resource = 'deposits'
 
     def perform_create(self, serializer):
         amount = serializer.validated_data['amount']
@@ -83,16 +189,11 @@ class DepositViewSet(
         amount_post_fees = amount - stripe_fees - internal_fees
 
         if amount <= 50 or amount_post_fees <= 0:
-            raise Exception('Deposit amount too small.')
-
-        charge = stripe.Charge.create(
-            amount=amount,
-            currency='usd',
-            source=serializer.validated_data['stripeToken'],
-            stripe_account=self.request.user.profile.stripeAccountId,
-        )
+            raise ValidationError('Deposit amount too small.')
 
-        serializer.save(amount=amount_post_fees, user=self.request.user, id=charge.id)
+        # Charged by the settle_payments worker; credited once the charge succeeds
+        with transaction.atomic():
+            serializer.save(amount=amount_post_fees, grossAmount=amount, user=self.request.user, idempotencyKey=self.idempotency_key())
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -101,31 +202,45 @@ class DepositViewSet(
             return DepositSerializer
 
 
-class RegisterView(APIView):
+async def register(request):
+    """
+    Links the user's Stripe Express account. The OAuth exchange with Stripe
+    is awaited on the shared outbound client rather than holding a thread.
+    """
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
 
-    permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+    if 'code' not in request.GET:
+        return redirect('https://connect.stripe.com/express/oauth/authorize?client_id={}&stripe_user[email]={}'.format(
+            settings.STRIPE_CLIENT_ID,
+            request.user.email,
+        ))
 
-    def get(self, request):
-        if 'code' not in request.query_params:
-            return redirect('https://connect.stripe.com/express/oauth/authorize?client_id={}&stripe_user[email]={}'.format(
-                settings.STRIPE_CLIENT_ID,
-                request.user.email,
-            ))
-
-        else: 
-            resp = requests.post('https://connect.stripe.com/oauth/token', data={
+    try:
+        with metrics.timed('stripe', 'oauth_token'):
+            token = await outbound.post(settings.STRIPE_CONNECT_URL + '/oauth/token', {
                 'client_secret': settings.STRIPE_SECRET_KEY,
-                'code': request.query_params['code'],
+                'code': request.GET['code'],
                 'grant_type': 'authorization_code',
-            })
+            }, settings.STRIPE_OAUTH_TIMEOUT)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return JsonResponse({'detail': 'Could not link the Stripe account, try again.'}, status=502)
+
+    await sync_to_async(link_stripe_account)(request.user, token['stripe_user_id'])
+    return redirect('/')
 
-            request.user.profile.stripeAccountId = resp.json()['stripe_user_id']
-            request.user.profile.save()
 
-            return redirect('/')
+def link_stripe_account(user, account_id):
+    user.profile.stripeAccountId = account_id
+    user.profile.save()
+    routers.wrote(user.id)
 
 
 class TransferViewSet(
+        ReplicaReadMixin,
+        CachedReadMixin,
+        ValuesListMixin,
+        IdempotentCreateMixin,
         mixins.ListModelMixin,
         mixins.RetrieveModelMixin,
         mixins.CreateModelMixin,
@@ -135,21 +250,15 @@ class TransferViewSet(
     queryset = Transfer.objects.all()
     filter_backends = (IsOwnerFilterBackend,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+    cache_resource = 'transfers'
 
     def perform_create(self, serializer):
         amount = serializer.validated_data['amount']
         user = self.request.user
 
-        if self.request.user.profile.balance() < amount:
-            raise ValidationError('Insufficient balance.')
-
-        transfer = stripe.Transfer.create(
-            amount=amount,
-            currency='usd',
-            destination=user.profile.stripeAccountId,
-        )
-
-        serializer.save(user=user, id=transfer.id)
+        # Held from the balance now, paid out by the settle_payments worker
+        with Ledger.hold(user.id, amount):
+            serializer.save(user=user, idempotencyKey=self.idempotency_key())
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -159,6 +268,7 @@ class TransferViewSet(
 
 
 class AttributeViewSet(
+        ReplicaReadMixin,
         mixins.ListModelMixin,
         mixins.CreateModelMixin,
         mixins.RetrieveModelMixin,
@@ -176,42 +286,170 @@ class AttributeViewSet(
 
 
 class QueryViewSet(
+        ReplicaReadMixin,
+        CachedReadMixin,
+        ValuesListMixin,
+        BulkCreateMixin,
         mixins.ListModelMixin,
         mixins.CreateModelMixin,
         mixins.RetrieveModelMixin,
         viewsets.GenericViewSet
     ):
 
-    queryset = Query.objects.all()
+    queryset = Query.objects.select_related('response')
     filter_backends = (IsOwnerFilterBackend,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+    cache_resource = 'queries'
+    replica_actions = ('list', 'retrieve', 'export')
 
     @action(detail=False)
     def get(self, request):
-        query = random.choice(Query.objects.filter(response=None))
-
-        query.numRetrievals += 1
-        query.lastRetrieved = datetime.now()
-        query.save()
+        """
+        Leases an unanswered query whose requirements the worker's attributes
+        meet, waiting up to ?wait= seconds for one to be submitted if there
+        are none.
+        """
+        by_bid = request.query_params.get('order') == 'bid'
+        query = notify.wait([notify.QUERIES], lambda: dispatch.lease(request.user.id, by_bid=by_bid), wait_seconds(request, 'wait', 0))
+        if query is None:
+            raise NotFound('No queries available.')
 
         return response.Response(self.get_serializer(query).data)
 
+    @action(detail=False)
+    def lease(self, request):
+        """
+        Leases up to ?count= unanswered queries at once, waiting up to ?wait=
+        seconds for some to be submitted if there are none.
+        """
+        try:
+            count = int(request.query_params.get('count', 1))
+        except ValueError:
+            raise ValidationError('count must be an integer.')
+        if not 1 <= count <= settings.MAX_LEASE_COUNT:
+            raise ValidationError('count must be between 1 and {}.'.format(settings.MAX_LEASE_COUNT))
+
+        by_bid = request.query_params.get('order') == 'bid'
+        queries = notify.wait([notify.QUERIES], lambda: dispatch.lease_many(request.user.id, count, by_bid=by_bid), wait_seconds(request, 'wait', 0))
+        return response.Response(self.get_serializer(queries, many=True).data)
+
+    @action(detail=False)
+    def wait(self, request):
+        """
+        Blocks until at least one of the ?ids= queries (comma separated) is
+        answered or expires, or ?timeout= seconds pass, then returns the
+        answered and expired ones.
+        """
+        try:
+            ids = [uuid.UUID(id) for id in request.query_params.get('ids', '').split(',')]
+        except ValueError:
+            raise ValidationError('ids must be comma separated query ids.')
+        if len(ids) > settings.MAX_WAIT_QUERIES:
+            raise ValidationError('At most {} queries may be awaited at once.'.format(settings.MAX_WAIT_QUERIES))
+        timeout = wait_seconds(request, 'timeout', settings.MAX_WAIT_SECONDS)
+
+        answered = self.filter_queryset(self.get_queryset()).filter(Q(response__isnull=False) | Q(expired=True), id__in=ids)
+        queries = notify.wait([notify.responses(request.user.id)], lambda: list(answered.all()), timeout)
+        return response.Response(self.get_serializer(queries, many=True).data)
+
+    @action(detail=False, renderer_classes=(JSONRenderer, EventStreamRenderer))
+    def events(self, request):
+        """
+        Streams a server-sent event for each new response to the requester's
+        queries. Reconnecting clients resume after their Last-Event-ID.
+        """
+        cursor = (timezone.now(), uuid.UUID(int=0))
+        last = request.META.get('HTTP_LAST_EVENT_ID')
+        if last:
+            try:
+                cursor = Response.objects.filter(query__user=request.user).values_list('created', 'id').get(id=last)
+            except (ValueError, DjangoValidationError, Response.DoesNotExist):
+                pass
+
+        stream = StreamingHttpResponse(events.stream(request.user.id, cursor), content_type='text/event-stream')
+        stream['Cache-Control'] = 'no-cache'
+        # Stops proxies such as nginx from buffering events
+        stream['X-Accel-Buffering'] = 'no'
+        return stream
+
+    @action(detail=False, renderer_classes=(JSONRenderer, NDJSONRenderer, CSVRenderer))
+    def export(self, request):
+        """
+        Streams all of the requester's queries with their responses and
+        ratings as ?type=ndjson (the default) or csv, or whichever of the two
+        the Accept header asks for, optionally filtered by ?created_after=,
+        ?created_before= (ISO 8601) and ?answered=true/false.
+        """
+        accepted = request.accepted_renderer.format
+        export_type = request.query_params.get('type', accepted if accepted in exports.TYPES else 'ndjson')
+        if export_type not in exports.TYPES:
+            raise ValidationError('type must be one of {}.'.format(', '.join(sorted(exports.TYPES))))
+
+        queryset = self.filter_queryset(Query.objects.all())
+        for param, lookup in (('created_after', 'created__gte'), ('created_before', 'created__lt')):
+            if param in request.query_params:
+                try:
+                    value = parse_datetime(request.query_params[param])
+                except ValueError:
+                    value = None
+                if value == None:
+                    raise ValidationError('{} must be an ISO 8601 datetime.'.format(param))
+                if timezone.is_naive(value):
+                    value = timezone.make_aware(value)
+                queryset = queryset.filter(**{lookup: value})
+        if 'answered' in request.query_params:
+            queryset = queryset.filter(response__isnull=request.query_params['answered'].lower() != 'true')
+
+        writer, content_type = exports.TYPES[export_type]
+        # The stream is read after the request returns, so pin its database now
+        stream = StreamingHttpResponse(writer(queryset.using(routers.current())), content_type=content_type)
+        stream['Content-Disposition'] = 'attachment; filename="queries.{}"'.format(export_type)
+        return stream
+
+    @action(detail=False, methods=['post'], parser_classes=(JSONParser, NDJSONParser))
+    def bulk(self, request):
+        """
+        Creates many queries from a JSON array or NDJSON stream, returning an
+        id or validation errors for each item in order. Valid items are
+        created together provided the balance covers all of their bids.
+        """
+        serializer, valid, errors = self.validate_bulk('queries', settings.MAX_BULK_QUERIES)
+        queries, requirements = {}, []
+        for index, data in valid.items():
+            fields, wanted = serializer.split(data)
+            queries[index] = Query(user=request.user, **fields)
+            requirements += [Requirement(query=queries[index], key=key, value=value) for key, value in wanted.items()]
+
+        total = sum(query.bid for query in queries.values())
+        with Ledger.hold(request.user.id, total):
+            Query.objects.bulk_create(queries.values())
+            Requirement.objects.bulk_create(requirements)
+            Ledger.apply(request.user.id, -total)
+            if queries:
+                notify.publish(notify.QUERIES)
+                caching.invalidate('queries', request.user.id)
+
+        return self.bulk_results(queries, errors)
+
     def perform_create(self, serializer):
         bid = serializer.validated_data.get('bid', 1)
-        if self.request.user.profile.balance() < bid:
-            raise ValidationError('Insufficient balance.')
-        serializer.save(user=self.request.user)
+        with Ledger.hold(self.request.user.id, bid):
+            serializer.save(user=self.request.user)
 
     def get_serializer_class(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return CreateQuerySerializer
-        elif self.action == 'get':
+        elif self.action in ('get', 'lease'):
             return GetQuerySerializer
         else:
             return QuerySerializer
 
 
 class ResponseViewSet(
+        ReplicaReadMixin,
+        CachedReadMixin,
+        ValuesListMixin,
+        BulkCreateMixin,
         mixins.ListModelMixin,
         mixins.CreateModelMixin,
         mixins.RetrieveModelMixin,
@@ -221,24 +459,59 @@ class ResponseViewSet(
     queryset = Response.objects.all()
     filter_backends = (IsOwnerFilterBackend,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+    cache_resource = 'responses'
+
+    @action(detail=False, methods=['post'], parser_classes=(JSONParser, NDJSONParser))
+    def bulk(self, request):
+        """
+        Answers many queries from a JSON array or NDJSON stream, returning an
+        id or validation errors for each item in order. Valid answers are
+        committed together with a single balance update.
+        """
+        _, valid, errors = self.validate_bulk('responses', settings.MAX_BULK_RESPONSES)
+        answers, seen = {}, set()
+        for index, data in valid.items():
+            if data['query'].id in seen:
+                errors[index] = {'query': ['Query is answered earlier in this batch.']}
+            else:
+                answers[index] = Response(user=request.user, **data)
+                seen.add(data['query'].id)
+
+        with transaction.atomic():
+            # Queries answered by someone else since validation are reported rather than failing the batch
+            ids = [answer.query_id for answer in answers.values()]
+            pending = set(Query.objects.select_for_update().filter(id__in=ids, pending=True).values_list('id', flat=True))
+            for index, answer in list(answers.items()):
+                if answer.query_id not in pending:
+                    errors[index] = {'query': ['Query has already been answered.']}
+                    del answers[index]
+
+            Response.objects.bulk_create(answers.values())
+            Query.objects.filter(id__in=pending).update(pending=False)
+            Requirement.objects.filter(query_id__in=pending).delete()
+            Callback.objects.bulk_create([Callback.build(answer, answer.query) for answer in answers.values() if answer.query.callback != None])
+            Ledger.apply(request.user.id, sum(answer.query.bid for answer in answers.values()))
+            for requester in set(answer.query.user_id for answer in answers.values()):
+                notify.publish(notify.responses(requester))
+                caching.invalidate('queries', requester)
+            caching.invalidate('responses', request.user.id)
+
+        return self.bulk_results(answers, errors)
 
     def perform_create(self, serializer):
-        try:
-            url = serializer.validated_data['query'].callback
-            if url != None:
-                resp = requests.post(url, data=serializer.validated_data)
-        except:
-            pass
-
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
 
     def get_serializer_class(self):
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             return CreateResponseSerializer
         else:
             return ResponseSerializer
 
 class RatingViewSet(
+        ReplicaReadMixin,
+        CachedReadMixin,
+        ValuesListMixin,
         mixins.ListModelMixin,
         mixins.CreateModelMixin,
         mixins.RetrieveModelMixin,
@@ -249,6 +522,7 @@ class RatingViewSet(
     queryset = Rating.objects.all()
     filter_backends = (IsOwnerFilterBackend,)
     permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+    cache_resource = 'ratings'
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -260,6 +534,21 @@ class RatingViewSet(
             return RatingSerializer
 
 
+class ReputationViewSet(
+        ReplicaReadMixin,
+        mixins.RetrieveModelMixin,
+        viewsets.GenericViewSet
+    ):
+    """
+    Any worker's reputation, by user id.
+    """
+
+    queryset = Reputation.objects.all()
+    serializer_class = ReputationSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    lookup_field = 'user'
+
+
 class MessengerLoginView(auth_views.LoginView):
     def get_success_url(self):
         return self.request.GET.get('redirect_uri') + '&authorization_code=' + str(self.request.user.profile.id)
@@ -271,6 +560,9 @@ class MessengerRegisterView(auth_views.LoginView):
 
 
 class MessengerView(APIView):
+    # Deliveries come from Facebook, which backs off by itself
+    throttle_classes = ()
+
     def get(self, request):
         token_sent = request.query_params.get("hub.verify_token")
         if token_sent == settings.VERIFY_TOKEN:
@@ -279,94 +571,12 @@ class MessengerView(APIView):
 
     def post(self, request):
         try:
-            for event in request.data.get('entry'):
-                messaging = event.get('messaging')
-                for message in messaging:
-
-                    sender_id = message.get('sender').get('id')
-
-                    if message.get('message'):
-
-                        text = message.get('message').get('text')
-
-                        responded_to_query = False
-                        # See if the sender is a logged in user and, if so, has a current query to be answered
-                        try:
-                            profile = Profile.objects.get(messengerId=sender_id)
-                            query = Query.objects.get(id=profile.currentQueryId)
-                            Response.objects.create(user=profile.user, query=query, text=text)
-
-                            profile.currentQueryId = None
-                            profile.save()
-
-                            bot.send_text_message(sender_id, "Thanks! You've been credited {} cents.".format(query.bid))
-                            responded_to_query = True
-                        except Exception as e:
-                            pass
-
-                        print(text)
-
-                        if responded_to_query:
-                            pass
-
-                        elif text == 'help':
-                            bot.send_text_message(sender_id, 'Hello! Try sending some of the following to interact with our system.\n\nregister\nlogin\nlogout\nget')
-                            
-                        elif text == 'register':
-                            bot.send_button_message(
-                                sender_id, 'Click here to register.', [{
-                                        'type': 'web_url',
-                                        'url': 'https://people-api-server.herokuapp.com/messenger-register/',
-                                        'title': 'Register',
-                                    }]
-                                )
+            payload = request.data
+        except ParseError:
+            payload = None
 
-                        elif text == 'login':
-                            bot.send_button_message(
-                                sender_id, 'Welcome! Click here to login.', [{
-                                        'type': 'account_link',
-                                        'url': 'https://people-api-server.herokuapp.com/messenger-login/',
-                                    }]
-                                )
-
-                        elif text == 'logout':
-                            bot.send_button_message(
-                                sender_id, 'Sorry to see you go! Click here to logout.', [{
-                                        'type': 'account_unlink'
-                                    }]
-                                )
-
-                        elif text == 'get':
-                            query = random.choice(Query.objects.filter(response=None))
-
-                            profile = Profile.objects.get(messengerId=sender_id)
-                            profile.currentQueryId = query.id
-                            profile.save()
-
-                            bot.send_text_message(sender_id, 'Here you go {}.\n\n{}'.format(profile.user.username, query.text))
-
-                        else:
-                            bot.send_text_message(sender_id, "Sorry, didn't quite understand that.")
-
-                    elif message.get('account_linking'):
-                        if message.get('account_linking').get('status') == 'linked':
-
-                            auth_code = message.get('account_linking').get('authorization_code')
-
-                            profile = Profile.objects.get(id=auth_code)
-                            profile.messengerId = sender_id
-                            profile.save()
-
-                            bot.send_text_message(sender_id, 'Welcome {}!'.format(profile.user.username))
-
-                        else:
-
-                            profile = Profile.objects.get(messengerId=sender_id)
-                            profile.messengerId = None
-                            profile.save()
-
-        except Exception as e:
-            print(e)
+        # Acknowledged whatever it holds, or Facebook keeps redelivering it
+        for message in messenger.events(payload):
+            messenger.enqueue(message)
 
         return HttpResponse('Message processed.')
-
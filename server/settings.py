@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
+from django.core.exceptions import ImproperlyConfigured
+
+import dj_database_url
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -42,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'people.middleware.MetricsMiddleware',
+    'people.middleware.LoadSheddingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,13 +80,60 @@ WSGI_APPLICATION = 'server.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
+# Threads per web process, gunicorn's --threads in the Procfile
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 128))
+
+# Database connections each web process may hold open. Heroku Postgres allows
+# between 20 and 500 across every dyno and process, so this times the number
+# of web processes has to leave room for the workers.
+DATABASE_MAX_CONNECTIONS = int(os.environ.get('DATABASE_MAX_CONNECTIONS', 20))
+
+# Seconds each thread keeps its database connections open between requests.
+# Every thread would end up holding one, so connections are only kept when
+# the threads fit in DATABASE_MAX_CONNECTIONS; otherwise each request opens
+# its own.
+DATABASE_CONN_MAX_AGE = int(os.environ.get('DATABASE_CONN_MAX_AGE', 600 if WEB_THREADS <= DATABASE_MAX_CONNECTIONS else 0))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
     }
 }
 
+# Read-only replicas of the default database as comma separated URLs, e.g.
+# DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3 to try them locally
+for i, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    DATABASES['replica{}'.format(i)] = dj_database_url.parse(
+        url, conn_max_age=DATABASE_CONN_MAX_AGE, ssl_require=url.startswith('postgres'),
+    )
+    # Tests read their own writes through the replicas
+    DATABASES['replica{}'.format(i)]['TEST'] = {'MIRROR': 'default'}
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['people.routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the default database after they (or anyone
+# else) change their data, which needs to cover the replicas' lag
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+
+# REST framework
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'people.pagination.CreatedCursorPagination',
+    'PAGE_SIZE': 100,
+    'DEFAULT_THROTTLE_CLASSES': ('people.throttling.TokenBucketThrottle',),
+    # Keeps /schema/ a Core API document
+    'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+}
+
+# Largest page a client may ask for with ?page_size=
+MAX_PAGE_SIZE = 1000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -127,7 +179,7 @@ STATIC_URL = '/static/'
 # SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 # SESSION_COOKIE_SECURE = True
 # CSRF_COOKIE_SECURE = True
-SECURE_SSL_REDIRECT = True
+SECURE_SSL_REDIRECT = os.environ.get('SECURE_SSL_REDIRECT', 'True') == 'True'
 
 
 # Stripe
@@ -143,10 +195,166 @@ else:
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_TEST_SECRET_KEY', '')
     STRIPE_CLIENT_ID = os.environ.get('STRIPE_TEST_CLIENT_ID', '')
 
+# Overrides the Stripe API base URL, e.g. to point at a local fake Stripe
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+STRIPE_CONNECT_URL = os.environ.get('STRIPE_CONNECT_URL', 'https://connect.stripe.com')
+STRIPE_OAUTH_TIMEOUT = 10
+
+# Connections each process's shared outbound client keeps open at most
+OUTBOUND_CONNECTIONS = 100
+
 ACCESS_TOKEN = os.environ.get('ACCESS_TOKEN', '')
 VERIFY_TOKEN = os.environ.get('VERIFY_TOKEN', '')
+# Overrides the Graph API base URL, e.g. to point at a local fake Send API
+MESSENGER_GRAPH_URL = os.environ.get('MESSENGER_GRAPH_URL')
+MESSENGER_CONCURRENCY = int(os.environ.get('MESSENGER_CONCURRENCY', 16))
+MESSENGER_IDENTITY_CACHE_SIZE = 10000
+MESSENGER_IDENTITY_TTL = 300
+# Seconds a Send API call may take, so one hung call can't stall a batch
+MESSENGER_SEND_TIMEOUT = 10
+# Processed webhook events are kept this long to drop Facebook's redeliveries
+MESSENGER_EVENT_RETENTION_DAYS = 7
+
+
+# Metrics
+
+# When set, /metrics requires an 'Authorization: Bearer <METRICS_TOKEN>' header
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Worker processes don't serve /metrics. They push theirs to a Prometheus
+# pushgateway every METRICS_PUSH_SECONDS and serve them on METRICS_PORT, when
+# either is set.
+METRICS_PUSHGATEWAY_URL = os.environ.get('METRICS_PUSHGATEWAY_URL')
+METRICS_PUSH_SECONDS = 15
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+
+
+# Dispatch
+
+# How long a retrieved query is hidden from other workers before it can be handed out again
+QUERY_LEASE_SECONDS = int(os.environ.get('QUERY_LEASE_SECONDS', 300))
+
+
+# Callbacks
+
+CALLBACK_TIMEOUT = 10
+CALLBACK_CONCURRENCY = int(os.environ.get('CALLBACK_CONCURRENCY', 16))
+CALLBACK_MAX_ATTEMPTS = 8
+# Retries wait CALLBACK_BACKOFF_SECONDS * 2 ** (attempts - 1), capped at CALLBACK_MAX_BACKOFF_SECONDS
+CALLBACK_BACKOFF_SECONDS = 30
+CALLBACK_MAX_BACKOFF_SECONDS = 3600
+
+
+# Caching
+
+# Cache invalidations have to reach every process, so production needs a
+# shared cache; without REDIS_URL each process keeps its own.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cached responses are only served from a cache every process shares: a
+# process-local one would miss invalidations made by the other processes.
+SHARED_CACHE = bool(os.environ.get('REDIS_URL'))
+
+# Which users wrote recently, to keep their reads off the replicas, has to be
+# seen by every process too
+if DATABASE_REPLICAS and not SHARED_CACHE:
+    raise ImproperlyConfigured('DATABASE_REPLICA_URLS needs a shared cache, set REDIS_URL.')
+
+# So do the rate limits' token buckets, or each process would allow the whole
+# limit. Heroku sets DYNO; local runs and tests limit each process on its own.
+if os.environ.get('DYNO') and not SHARED_CACHE:
+    raise ImproperlyConfigured('Rate limits need a shared cache, set REDIS_URL.')
+
+RESPONSE_CACHE_SECONDS = 300
+
+
+# Rate limits
+
+# Token buckets as (tokens refilled per second, capacity). A request spends
+# its route's cost from the client's bucket for the route, if it has one,
+# then from their bucket across all routes. Routes are named like query-get
+# (GET /queries/get/) or profile.
+RATE_LIMIT = (50, 500)
+RATE_LIMIT_ROUTES = {
+    'query-get': (20, 100),
+    'query-lease': (20, 100),
+    'query-export': (1, 100),
+    'profile': (10, 50),
+}
+# Tokens a request spends, 1 unless its route is listed
+RATE_LIMIT_COSTS = {
+    'profile': 2,
+    'query-get': 4,
+    'query-lease': 4,
+    'query-bulk': 20,
+    'query-export': 50,
+    'response-bulk': 10,
+}
+
+# Requests each web process serves at once before answering 503 to the rest.
+# Long-polls and event streams mostly sleep without a database connection,
+# so they have their own, larger cap. Together they stay a little below
+# WEB_THREADS so that there are threads left to answer 503, and the others
+# leave a quarter of the database connections for parked requests' checks.
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', min(WEB_THREADS // 4 - 4, DATABASE_MAX_CONNECTIONS * 3 // 4)))
+MAX_PARKED_REQUESTS = int(os.environ.get('MAX_PARKED_REQUESTS', WEB_THREADS * 3 // 4))
+LOAD_SHED_RETRY_AFTER = 1
+
+
+# Waiting
+
+# Cap on how long wait requests park, below the Heroku router's 30 second timeout
+MAX_WAIT_SECONDS = 25
+MAX_WAIT_QUERIES = 100
+# Waiters re-check at least this often in case a notification was missed
+NOTIFY_POLL_SECONDS = 5
+SSE_KEEPALIVE_SECONDS = 15
+SSE_MAX_SECONDS = 300
+
+
+# Settlement
+
+SETTLEMENT_TIMEOUT = 30
+SETTLEMENT_CONCURRENCY = int(os.environ.get('SETTLEMENT_CONCURRENCY', 8))
+SETTLEMENT_MAX_ATTEMPTS = 8
+# Retries wait SETTLEMENT_BACKOFF_SECONDS * 2 ** (attempts - 1), capped at SETTLEMENT_MAX_BACKOFF_SECONDS
+SETTLEMENT_BACKOFF_SECONDS = 30
+SETTLEMENT_MAX_BACKOFF_SECONDS = 3600
+
+
+# Queries
+
+MAX_BULK_QUERIES = 10000
+MAX_BULK_RESPONSES = 1000
+MAX_LEASE_COUNT = 100
+MAX_QUERY_REQUIREMENTS = 16
+MAX_QUERY_TTL = 30 * 24 * 3600
+
+# Seconds after which expire_queries returns a balance hold to its user, far
+# longer than any request that could still be spending it
+HOLD_TIMEOUT = 300
+
+# How quickly old ratings stop counting towards a worker's recent reputation
+REPUTATION_HALF_LIFE_DAYS = 30
+
+REGEX_MAX_LENGTH = 1000
+REGEX_CACHE_SIZE = 1024
+# Seconds a single response may spend matching its query regex
+REGEX_TIMEOUT = 0.1
 
 
 import django_heroku
 django_heroku.settings(locals())
+DATABASES['default']['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE
 
@@ -17,7 +17,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.schemas import get_schema_view
 from rest_framework.routers import DefaultRouter
-from people import views
+from people import views, metrics
+from people.middleware import shed_exempt
 
 schema_view = get_schema_view(title='People API')
 
@@ -29,17 +30,19 @@ router.register('responses', views.ResponseViewSet)
 router.register('deposits', views.DepositViewSet)
 router.register('transfers', views.TransferViewSet)
 router.register('ratings', views.RatingViewSet)
+router.register('reputations', views.ReputationViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('rest_framework.urls')),
     path('schema/', schema_view),
     path('', include(router.urls)),
-    path('profile/', views.ProfileView.as_view()),
-    path('deposit/', views.DepositView.as_view()),
-    path('register/', views.RegisterView.as_view()),
+    path('profile/', views.ProfileView.as_view(), name='profile'),
+    path('deposit/', views.DepositView.as_view(), name='deposit'),
+    path('register/', views.register, name='register'),
     path('messenger-login/', views.MessengerLoginView.as_view(template_name='login.html')),
     path('messenger-register/', views.MessengerRegisterView.as_view(template_name='login.html')),
-    path('messenger/', views.MessengerView.as_view()),
+    path('messenger/', views.MessengerView.as_view(), name='messenger'),
+    path('metrics', shed_exempt(metrics.view)),
 ]
 